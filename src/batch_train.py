@@ -0,0 +1,195 @@
+from concurrent.futures import ProcessPoolExecutor
+from fractions import Fraction
+from multiprocessing import shared_memory
+import sys
+import numpy as np
+from context_counts import ContextCounts
+from data import Data
+import model_file
+import prob_tree
+import tree
+
+
+class BatchResult:
+    def __init__(self, counts, models, pooled_counts, pooled_model):
+        """Result of the training of many series.
+
+        Args:
+            counts ([ContextCounts]): the counts of each series.
+            models ([FlatTree]): the pruned MAP tree of each series.
+            pooled_counts (ContextCounts): the sum of the counts of all the series.
+            pooled_model (FlatTree): the pruned MAP tree of the pooled counts.
+        """
+        self.counts = counts
+        self.models = models
+        self.pooled_counts = pooled_counts
+        self.pooled_model = pooled_model
+
+
+class EvidenceComparison:
+    def __init__(self, log_pws, pooled_log_pw):
+        """Evidence of one context tree model per series against a single model for all of them.
+
+        Args:
+            log_pws ([float]): the natural log of the Pw of the tree of each series.
+            pooled_log_pw (float): the natural log of the Pw of the tree of the pooled counts.
+        """
+        self.log_pws = log_pws
+        self.pooled_log_pw = pooled_log_pw
+
+    def separate_log_pw(self):
+        """
+        Returns:
+            float: the natural log of the evidence of the per-series models, the sum of their log Pw.
+        """
+        return sum(self.log_pws)
+
+    def log_ratio(self):
+        """
+        Returns:
+            float: the natural log of the Bayes factor of the pooled model against the per-series models,
+                positive when the series are better explained by a single tree.
+        """
+        return self.pooled_log_pw - self.separate_log_pw()
+
+
+def compare_evidence(counts, beta, pooled_counts=None):
+    """Compare per-series and pooled models by their evidence, from the counts only.
+    Args:
+        counts ([ContextCounts]): the counts of each series, with the same m and D.
+        beta (Fraction): the beta used by some probabilities computations.
+        pooled_counts (ContextCounts|None): the sum of counts, merged here when not given.
+    Returns:
+        EvidenceComparison: the evidences.
+    """
+    if pooled_counts is None:
+        pooled_counts = ContextCounts.empty(counts[0].m, counts[0].D).merge(*counts)
+    return EvidenceComparison([c.log_pw(beta) for c in counts], pooled_counts.log_pw(beta))
+
+
+def max_rows(n, m, D):
+    """
+    Returns:
+        [int]: for each depth d < D, the largest number of contexts of a series of length n.
+    """
+    return [min(max(n - d, 0), m ** d) for d in range(D)]
+
+
+def fit_counts(counts, beta):
+    """
+    Returns:
+        FlatTree: the pruned MAP tree of some counts.
+    """
+    top = prob_tree.prune_counts_main(counts, beta)
+    return model_file.FlatTree.from_nodes([top], model_file.KIND_MAP, beta, counts.D)
+
+
+# shared memory blocks of a worker process, attached once by _init_worker
+_shared = {}
+
+
+def _init_worker(data_name, keys_name, counts_name):
+    for name, shm_name in (("data", data_name), ("keys", keys_name), ("counts", counts_name)):
+        _shared[name] = shared_memory.SharedMemory(name=shm_name)
+
+
+def _shared_array(name, size):
+    return np.ndarray((size,), dtype=np.int64, buffer=_shared[name].buf)
+
+
+def _count_series(index, lo, hi, m, D, beta, row_offset, sizes):
+    """Count the series data[lo:hi] into the shared result arrays, from row row_offset, and fit its tree.
+    sizes are the lengths of the shared data, keys and counts arrays.
+    Returns:
+        (int, [int], FlatTree): the index of the series, its number of contexts per depth and its tree.
+    """
+    data = _shared_array("data", sizes[0])
+    counts = ContextCounts.count(data[lo:hi], m, D)
+    keys = _shared_array("keys", sizes[1])
+    all_counts = _shared_array("counts", sizes[2]).reshape(-1, m)
+    rows = []
+    for depth_keys, depth_counts in zip(counts.keys, counts.counts):
+        keys[row_offset:row_offset + len(depth_keys)] = depth_keys
+        all_counts[row_offset:row_offset + len(depth_keys)] = depth_counts
+        rows.append(len(depth_keys))
+        row_offset += len(depth_keys)
+    return (index, rows, fit_counts(counts, beta))
+
+
+def train_series(series, m, D, beta, processes=None):
+    """Train one prob_tree MAP tree per series and one on all of them, with the same D and beta.
+    The series are counted separately, no context crosses the boundary of two series. The counting
+    and the fits run in a process pool started once for all the series: the series are read from
+    shared memory and the counts are written to shared result arrays, so only the small trees are
+    sent back to this process.
+    Args:
+        series ([[int]]): the series.
+        m (int): the alphabet size.
+        D (int): the depth of the trees, also the size of the context.
+        beta (Fraction): the beta used by some probabilities computations.
+        processes (int|None): the number of worker processes, 1 to train in this process.
+    Returns:
+        BatchResult: the counts and the trees of every series, and of the pooled series.
+    """
+    if processes == 1:
+        counts = []
+        models = []
+        for i, s in enumerate(series):
+            tree.debug("Training series {}".format(i))
+            counts.append(ContextCounts.count(s, m, D))
+            models.append(fit_counts(counts[-1], beta))
+    else:
+        arrays = [np.asarray(s, dtype=np.int64) for s in series]
+        bounds = np.cumsum([0] + [len(a) for a in arrays])
+        row_offsets = np.cumsum([0] + [sum(max_rows(len(a), m, D)) for a in arrays])
+        sizes = (max(int(bounds[-1]), 1), max(int(row_offsets[-1]), 1), max(int(row_offsets[-1]), 1) * m)
+        blocks = [shared_memory.SharedMemory(create=True, size=8 * size) for size in sizes]
+        try:
+            data = np.ndarray((sizes[0],), dtype=np.int64, buffer=blocks[0].buf)
+            for a, lo in zip(arrays, bounds):
+                data[lo:lo + len(a)] = a
+            with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                                     initargs=tuple(b.name for b in blocks)) as executor:
+                futures = [executor.submit(_count_series, i, int(bounds[i]), int(bounds[i + 1]), m, D, beta,
+                                           int(row_offsets[i]), sizes)
+                           for i in range(len(arrays))]
+                results = [f.result() for f in futures]
+
+            keys = np.ndarray((sizes[1],), dtype=np.int64, buffer=blocks[1].buf)
+            all_counts = np.ndarray((sizes[2],), dtype=np.int64, buffer=blocks[2].buf).reshape(-1, m)
+            counts = []
+            models = []
+            for i, rows, model in results:
+                offset = int(row_offsets[i])
+                depth_keys = []
+                depth_counts = []
+                for n_rows in rows:
+                    depth_keys.append(keys[offset:offset + n_rows].copy())
+                    depth_counts.append(all_counts[offset:offset + n_rows].copy())
+                    offset += n_rows
+                counts.append(ContextCounts(m, D, depth_keys, depth_counts))
+                models.append(model)
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+    tree.debug("Training pooled series")
+    pooled_counts = ContextCounts.empty(m, D).merge(*counts)
+    return BatchResult(counts, models, pooled_counts, fit_counts(pooled_counts, beta))
+
+
+if __name__ == "__main__":
+    paths = sys.argv[1:] if len(sys.argv) > 1 else ["./return_class_train.txt"]
+    datas = [Data(path) for path in paths]
+    m = max(d.m for d in datas)
+
+    beta = Fraction(1, 2)
+    result = train_series([d.data for d in datas], m, D=6, beta=beta)
+    evidence = compare_evidence(result.counts, beta, result.pooled_counts)
+    print("series\tsymbols\tleaves\tlog_pw")
+    for path, counts, model, log_pw in zip(paths, result.counts, result.models, evidence.log_pws):
+        print("{}\t{}\t{}\t{:.3f}".format(path, counts.total(), model.to_node().count_leaves(), log_pw))
+    print("pooled\t{}\t{}\t{:.3f}".format(result.pooled_counts.total(), result.pooled_model.to_node().count_leaves(),
+                                         evidence.pooled_log_pw))
+    print("log Bayes factor pooled / separate: {:.3f}".format(evidence.log_ratio()))
@@ -0,0 +1,123 @@
+import random
+import sys
+import time
+import tracemalloc
+from fractions import Fraction
+import numpy as np
+import generators
+import kTree
+import prob_tree
+import tree
+
+
+class BaselineNode:
+    def __init__(self, value, m):
+        """Node without __slots__ holding its counts in a list, the layout the memory of the
+        nodes is compared against.
+        """
+        self.m = m
+        self.value = value
+        self.children = [None] * m
+        self.count = [0] * m
+        self.pe = None
+        self.pw = None
+        self.should_prune = False
+        self.pm = None
+
+    def invalidate_stats(self):
+        pass
+
+    def iter_children(self):
+        return (c for c in self.children if c is not None)
+
+
+class BaselineKTreeNode(BaselineNode):
+    def __init__(self, value, m, k):
+        """Baseline kTree node holding its own k scores and k x m backpointer matrix."""
+        super().__init__(value, m)
+        self.k = k
+        self.pms = [Fraction(0)] * k
+        self.Bs = np.full((k, m), -1)
+
+
+def measure(func):
+    """Run a function while tracing the memory allocations.
+    Returns:
+        (object, int, float): the result of func, the memory still allocated by it and the elapsed time.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    res = func()
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (res, current, elapsed)
+
+
+def count_nodes(top):
+    return sum(1 for _ in tree.build_node_iter(top))
+
+
+def bench_count_tree(data, m, D, node_builder=prob_tree.ProbNode):
+    """Memory of the count tree of prob_tree."""
+    def build():
+        top = node_builder(None, m)
+        tree.build_counts(top, data, D, node_builder)
+        return top
+    top, size, elapsed = measure(build)
+    return (count_nodes(top), size, elapsed)
+
+
+def build_baseline_full_tree(m, k, D):
+    """kTree.build_full_tree with BaselineKTreeNode."""
+    def build_node(value, depth_to_go):
+        node = BaselineKTreeNode(value, m, k)
+        if depth_to_go != 0:
+            node.children = [build_node(i, depth_to_go - 1) for i in range(m)]
+        return node
+    return build_node(None, D - 1)
+
+
+def bench_full_tree(m, k, D, build=kTree.build_full_tree):
+    """Memory of the full tree of kTree."""
+    top, size, elapsed = measure(lambda: build(m, k, D))
+    return (count_nodes(top), size, elapsed)
+
+
+def report(name, current, baseline):
+    """Print the memory of a benchmark against its baseline.
+    Args:
+        name (string): the name of the benchmark.
+        current ((int, int, float)): the nodes, bytes and seconds of the current nodes.
+        baseline ((int, int, float)): the same for the baseline nodes.
+    """
+    nodes, size, elapsed = current
+    _, baseline_size, _ = baseline
+    print("{:<36}{:>10}{:>14}{:>12.1f}{:>12.1f}{:>11.1%}{:>10.3f}".format(
+        name, nodes, size, baseline_size / nodes, size / nodes, 1 - size / baseline_size, elapsed))
+
+
+if __name__ == "__main__":
+    N = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    random.seed(0)
+    markov = generators.MarkovGen().next_n(N)
+    # up to tree.SPARSE_THRESHOLD symbols the nodes stay dense and only save their slots, above it
+    # the sparse children and counts add to the saving
+    medium = [random.randrange(16) for _ in range(N)]
+    wide = [random.randrange(32) for _ in range(N)]
+
+    print("{:<36}{:>10}{:>14}{:>12}{:>12}{:>11}{:>10}".format(
+        "benchmark", "nodes", "bytes", "base b/node", "bytes/node", "reduction", "seconds"))
+    report("count tree m=3 D=9 slots", bench_count_tree(markov, 3, 9),
+           bench_count_tree(markov, 3, 9, BaselineNode))
+    report("count tree m=16 D=4 slots", bench_count_tree(medium, 16, 4),
+           bench_count_tree(medium, 16, 4, BaselineNode))
+    report("count tree m=32 D=4 sparse + slots", bench_count_tree(wide, 32, 4),
+           bench_count_tree(wide, 32, 4, BaselineNode))
+    report("kTree full tree m=3 k=5 D=7", bench_full_tree(3, 5, 7),
+           bench_full_tree(3, 5, 7, build_baseline_full_tree))
+
+    top = prob_tree.ProbNode(None, 3)
+    tree.build_counts(top, markov, 9, lambda value, m: prob_tree.ProbNode(value, m))
+    _, _, elapsed = measure(lambda: top.compute_probas(Fraction(1, 2)))
+    print("compute_probas m=3 D=9: {:.3f}s".format(elapsed))
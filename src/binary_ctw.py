@@ -0,0 +1,164 @@
+from fractions import Fraction
+import sys
+import numpy as np
+from data import Data
+import context_table
+import graphviz
+import prob_tree
+import tree
+
+
+class BinaryNode(prob_tree.ProbNode):
+    __slots__ = ()
+
+    def __init__(self, value, m):
+        """Constructs a node of a binary context tree: the contexts are made of m-ary symbols,
+        so the node has m children, but it only counts the two branches of one decomposition split.
+
+        Args:
+            value (int|None): The value to be stored in this node.
+            m (int): The alphabet size of the contexts.
+        """
+        super().__init__(value, m)
+        self.count = tree.new_count(2)
+
+
+def decomposition(lo, hi):
+    """Balanced binary decomposition of the symbols lo <= a < hi.
+    Yields:
+        (int, int, int): for each split, the range lo <= a < hi it splits at mid, the symbols
+            below mid taking the branch 0 and the others the branch 1.
+    """
+    if hi - lo >= 2:
+        mid = (lo + hi) // 2
+        yield (lo, mid, hi)
+        for split in decomposition(lo, mid):
+            yield split
+        for split in decomposition(mid, hi):
+            yield split
+
+
+def build_binary_counts(top_node, data, D, split):
+    """Complete the counts of the binary tree of a split, as tree.build_counts does. Only the
+    positions whose symbol is in the range of the split are counted, with their branch as value.
+    Args:
+        top_node (BinaryNode): the top node of the tree.
+        data ([int]): the input data.
+        D (int): the context size.
+        split ((int, int, int)): the split, see decomposition.
+    """
+    lo, mid, hi = split
+    m = top_node.m
+    for t in range(len(data)):
+        symbol = data[t]
+        if not lo <= symbol < hi:
+            continue
+        value = 0 if symbol < mid else 1
+        insert_node = top_node
+        insert_node.count[value] += 1
+        for c in reversed(data[max(0, t - D + 1):t]):
+            if insert_node.children[c] is None:
+                insert_node.children[c] = BinaryNode(c, m)
+            insert_node = insert_node.children[c]
+            insert_node.count[value] += 1
+    top_node.invalidate_stats()
+
+
+class BinaryDecomposition:
+    def __init__(self, m, D, splits, trees):
+        """Binary decomposition CTW model: an m-ary symbol is the path of its binary choices in the
+        decomposition tree, each choice being predicted by the binary context tree of its split.
+
+        Args:
+            m (int): the alphabet size.
+            D (int): the depth of the trees, also the size of the context.
+            splits ([(int, int, int)]): the splits, see decomposition.
+            trees ([BinaryNode]): the pruned binary tree of each split.
+        """
+        self.m = m
+        self.D = D
+        self.L = max(0, D - 1)
+        self.splits = splits
+        self.trees = trees
+        self._tables = None
+
+    def log_pw(self):
+        """
+        Returns:
+            float: the natural log of the probability of the training data, the product of the Pw of every split.
+        """
+        return sum(tree.log_fraction(t.pw) for t in self.trees)
+
+    def predict(self, context):
+        """
+        Args:
+            context ([int]): the past symbols, the most recent being the last one.
+        Returns:
+            np.ndarray: the next symbol distribution given the context.
+        """
+        probas = np.ones(self.m)
+        for (lo, mid, hi), top in zip(self.splits, self.trees):
+            node = top
+            for c in reversed(context[max(0, len(context) - self.L):]):
+                next_node = node.children[c]
+                if next_node is None:
+                    break
+                node = next_node
+            n = sum(node.count)
+            probas[lo:mid] *= (node.count[0] + 0.5) / (n + 1)
+            probas[mid:hi] *= (node.count[1] + 0.5) / (n + 1)
+        return probas
+
+    def predict_history(self, history):
+        """Next symbol distributions along a whole series, see context_table.ContextTable.predict_history.
+        Args:
+            history ([int]): the series.
+        Returns:
+            np.ndarray: (len(history) - D + 1, m) the distribution of history[t] given its D-1 previous
+                symbols, for each t >= D-1.
+        """
+        if self._tables is None:
+            self._tables = [context_table.compile_tree(top, self.D) for top in self.trees]
+        probas = None
+        for (lo, mid, hi), table in zip(self.splits, self._tables):
+            branches = table.predict_history(history)
+            if probas is None:
+                probas = np.ones((len(branches), self.m))
+            probas[:, lo:mid] *= branches[:, :1]
+            probas[:, mid:hi] *= branches[:, 1:]
+        return probas
+
+
+def prune_tree_main(data, m, D, beta):
+    """Main function for MAPT algorithm with binary decomposition, see prob_tree.prune_tree_main.
+    Args:
+        data ([int]): the input data.
+        m (int): the alphabet size.
+        D (int): the depth of the tree, also the size of the context.
+        beta (Fraction): the beta used by some probabilities computations.
+    Returns:
+        BinaryDecomposition: the pruned binary trees of every split.
+    """
+    splits = list(decomposition(0, m))
+    trees = []
+    for split in splits:
+        top = BinaryNode(None, m)
+        tree.debug("Building tree of split {}".format(split))
+        build_binary_counts(top, data, D, split)
+
+        tree.debug("Computing probas")
+        top.compute_probas(beta)
+
+        tree.debug("Pruning tree")
+        top.prune()
+        trees.append(top)
+    return BinaryDecomposition(m, D, splits, trees)
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "./return_class_train.txt"
+    data = Data(path)
+
+    model = prune_tree_main(data.data, m=data.m, D=6, beta=Fraction(1, 2))
+    for top in model.trees:
+        print(graphviz.main_node_to_graphviz(top, only_struct=True))
@@ -0,0 +1,186 @@
+import math
+import prob_tree
+import tree
+
+
+class CompressedNode:
+    __slots__ = ("label_pos", "label_start", "length", "count", "children", "log_pe", "log_pw")
+
+    def __init__(self, m, label_pos, label_start, length):
+        """Constructs a node of a path-compressed context tree. The node stands for a unary chain of
+        `length` nodes of the full tree, the last one (the bottom) being branching or a leaf. All the
+        chain nodes have the counts of the bottom one.
+
+        Args:
+            m (int): the alphabet size.
+            label_pos (int): a position t whose context goes through the edge, the symbol of the
+                edge at depth k + 1 is data[label_pos - 1 - k].
+            label_start (int): the depth of the parent node.
+            length (int): the number of chain nodes of the edge.
+        """
+        self.label_pos = label_pos
+        self.label_start = label_start
+        self.length = length
+        # counts of the chain nodes of the edge
+        self.count = [0] * m
+        self.children = {}
+        self.log_pe = None
+        self.log_pw = None
+
+
+def kt_log_pe(count):
+    """Natural log of the KT estimator probability of some counts, the log of Node.get_pe."""
+    return tree.kt_table(len(count)).log_pe(count)
+
+
+def chain_log_pw(log_pe, log_pw_below, n, log_beta, log_1_beta):
+    """Log Pw at the top of n chain nodes sharing the same Pe above a node of log Pw log_pw_below:
+    Pw = Pe * (1 - (1 - beta)^n) + (1 - beta)^n * Pw_below.
+    """
+    if n == 0:
+        return log_pw_below
+    decay = n * log_1_beta
+    return tree.logaddexp(log_pe + math.log1p(-math.exp(decay)), decay + log_pw_below)
+
+
+class CompressedTree:
+    def __init__(self, data, m, D):
+        """Build the path-compressed (PATRICIA-style) context tree of some data: the tree of
+        tree.build_counts where unary chains are collapsed into single edges. The number of nodes
+        grows with the number of branching contexts instead of N * D.
+
+        Args:
+            data ([int]): the input data.
+            m (int): the alphabet size.
+            D (int): the depth of the tree, also the size of the context.
+        """
+        self.data = list(data)
+        self.m = m
+        self.D = D
+        self.root = CompressedNode(m, 0, 0, 0)
+        for t in range(len(self.data)):
+            self.insert(t)
+
+    def symbol(self, node, depth):
+        """
+        Returns:
+            int: the symbol of the edge of node leading to the given depth + 1.
+        """
+        return self.data[node.label_pos - 1 - depth]
+
+    def insert(self, t):
+        """Count data[t] in all the contexts of position t, up to D-1 symbols."""
+        data = self.data
+        m = self.m
+        value = data[t]
+        P = min(t, self.D - 1)
+        node = self.root
+        node.count[value] += 1
+        depth = 0
+        while depth < P:
+            child = node.children.get(data[t - 1 - depth])
+            if child is None:
+                child = CompressedNode(m, t, depth, P - depth)
+                child.count[value] += 1
+                node.children[data[t - 1 - depth]] = child
+                return
+            j = 1
+            while j < child.length and depth + j < P and self.symbol(child, depth + j) == data[t - 1 - depth - j]:
+                j += 1
+            if j == child.length:
+                child.count[value] += 1
+                node = child
+                depth += j
+            else:
+                # the positions are inserted in increasing order and P never decreases, so the edges
+                # end at a depth <= P: the context leaves the edge at a mismatch, never stops inside it
+                assert depth + j < P
+                middle = self.split(node, child, j)
+                middle.count[value] += 1
+                leaf = CompressedNode(m, t, depth + j, P - depth - j)
+                leaf.count[value] += 1
+                middle.children[data[t - 1 - depth - j]] = leaf
+                return
+
+    def split(self, parent, child, j):
+        """Split the edge of child after its j first chain nodes.
+        Returns:
+            CompressedNode: the new node, bottom of the j first chain nodes.
+        """
+        middle = CompressedNode(self.m, child.label_pos, child.label_start, j)
+        middle.count = list(child.count)
+        parent.children[self.symbol(child, child.label_start)] = middle
+        middle.children[self.symbol(child, child.label_start + j)] = child
+        child.label_start += j
+        child.length -= j
+        return middle
+
+    def compute_probas(self, beta):
+        """Compute log Pe and log Pw of every node. The Pw of the chain nodes of an edge are
+        accumulated analytically, see chain_log_pw.
+        Args:
+            beta (Fraction): the beta used by some probabilities computations.
+        """
+        log_beta = math.log(beta)
+        log_1_beta = math.log(1 - beta)
+        order = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            stack.extend(node.children.values())
+        for node in reversed(order):
+            node.log_pe = kt_log_pe(node.count)
+            if node.children:
+                sub = log_1_beta + sum(c.log_pw for c in node.children.values())
+                log_pw = tree.logaddexp(log_beta + node.log_pe, sub)
+            else:
+                log_pw = node.log_pe
+            # the length - 1 chain nodes above the bottom one
+            node.log_pw = chain_log_pw(node.log_pe, log_pw, max(node.length - 1, 0), log_beta, log_1_beta)
+
+    def log_pw(self):
+        """
+        Returns:
+            float: the natural log of the Pw of the top node, see compute_probas.
+        """
+        return self.root.log_pw
+
+    def node_count(self):
+        """
+        Returns:
+            int: the number of compressed nodes.
+        """
+        res = 0
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            res += 1
+            stack.extend(node.children.values())
+        return res
+
+    def to_node(self, node_builder=None):
+        """Expand the compressed tree into the full tree of tree.build_counts.
+        Args:
+            node_builder ((int, int) -> Node): the node builder, ProbNode by default.
+        Returns:
+            Node: the top node of the full tree.
+        """
+        if node_builder is None:
+            node_builder = prob_tree.ProbNode
+        m = self.m
+        top = node_builder(None, m)
+        top.count = tree.new_count(m, self.root.count)
+        stack = [(self.root, top)]
+        while stack:
+            cnode, parent = stack.pop()
+            for child in cnode.children.values():
+                node = parent
+                for offset in range(child.length):
+                    value = self.symbol(child, child.label_start + offset)
+                    next_node = node_builder(value, m)
+                    next_node.count = tree.new_count(m, child.count)
+                    node.children[value] = next_node
+                    node = next_node
+                stack.append((child, node))
+        return top
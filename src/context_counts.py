@@ -0,0 +1,199 @@
+import math
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+import tree
+
+
+class ContextCounts:
+    def __init__(self, m, D, keys, counts):
+        """Array form of the counts of a context tree, as filled by tree.build_counts.
+        The context of depth d of a position t is packed as sum(data[t-d+j] * m^j) for j < d,
+        the most recent symbol being the most significant digit (see context_table.ContextTable).
+
+        Args:
+            m (int): the alphabet size.
+            D (int): the depth of the tree, also the size of the context.
+            keys ([np.ndarray]): for each depth d < D, the sorted keys of the contexts of that depth.
+            counts ([np.ndarray]): for each depth d < D, the (len(keys[d]), m) counts of the contexts.
+        """
+        self.m = m
+        self.D = D
+        self.keys = keys
+        self.counts = counts
+
+    @classmethod
+    def empty(cls, m, D):
+        """
+        Returns:
+            ContextCounts: counts without any context.
+        """
+        return cls(m, D, [np.zeros(0, dtype=np.int64) for _ in range(D)],
+                   [np.zeros((0, m), dtype=np.int64) for _ in range(D)])
+
+    @classmethod
+    def count(cls, data, m, D, t_lo=0, t_hi=None, start_lo=0, start_hi=None):
+        """Count the contexts of a series. A symbol data[t] is counted at depth d (0 <= d < D) when
+        t_lo <= t < t_hi and its context starts in the range start_lo <= t - d < start_hi.
+        With the default ranges, the counts are the ones of tree.build_counts(top, data, D, ...).
+        Args:
+            data ([int]|np.ndarray): the input data.
+            m (int): the alphabet size.
+            D (int): the depth of the tree, also the size of the context.
+        Returns:
+            ContextCounts: the counts.
+        """
+        if D * np.log2(m) >= 63:
+            raise ValueError("contexts of {} symbols over {} do not fit in 64 bits".format(D, m))
+        data = np.asarray(data, dtype=np.int64)
+        if t_hi is None:
+            t_hi = len(data)
+        if start_hi is None:
+            start_hi = len(data)
+        powers = m ** np.arange(D, dtype=np.int64)
+        keys = []
+        counts = []
+        for d in range(D):
+            lo = max(t_lo, start_lo + d, d)
+            hi = min(t_hi, start_hi + d, len(data))
+            if hi <= lo:
+                keys.append(np.zeros(0, dtype=np.int64))
+                counts.append(np.zeros((0, m), dtype=np.int64))
+                continue
+            if d == 0:
+                contexts = np.zeros(hi - lo, dtype=np.int64)
+            else:
+                contexts = sliding_window_view(data[lo - d:hi - 1], d) @ powers[:d]
+            pairs, pair_counts = np.unique(contexts * m + data[lo:hi], return_counts=True)
+            depth_keys, index = np.unique(pairs // m, return_inverse=True)
+            depth_counts = np.zeros((len(depth_keys), m), dtype=np.int64)
+            depth_counts[index, pairs % m] = pair_counts
+            keys.append(depth_keys)
+            counts.append(depth_counts)
+        return cls(m, D, keys, counts)
+
+    @classmethod
+    def from_tree(cls, top, D):
+        """Read the counts of a node tree.
+        Args:
+            top (Node): the top node of the tree.
+            D (int): the depth of the tree, also the size of the context.
+        Returns:
+            ContextCounts: the counts.
+        """
+        m = top.m
+        keys = [[] for _ in range(D)]
+        counts = [[] for _ in range(D)]
+        stack = [(top, 0, 0)]
+        while stack:
+            node, depth, key = stack.pop()
+            if any(node.count):
+                keys[depth].append(key)
+                counts[depth].append(list(node.count))
+            if depth + 1 < D:
+                stack.extend((c, depth + 1, key * m + c.value) for c in node.iter_children())
+        result = cls.empty(m, D)
+        for d in range(D):
+            if keys[d]:
+                order = np.argsort(keys[d])
+                result.keys[d] = np.array(keys[d], dtype=np.int64)[order]
+                result.counts[d] = np.array(counts[d], dtype=np.int64).reshape(-1, m)[order]
+        return result
+
+    def merge(self, *others, signs=None):
+        """Add (or subtract) other counts to these counts. Contexts whose counts become all zero are dropped.
+        Args:
+            others (ContextCounts): the counts to merge, with the same m and D.
+            signs ([int]|None): 1 to add, -1 to subtract, one per element of others. All 1 by default.
+        Returns:
+            ContextCounts: the merged counts.
+        """
+        if signs is None:
+            signs = [1] * len(others)
+        keys = []
+        counts = []
+        for d in range(self.D):
+            all_keys = np.concatenate([self.keys[d]] + [o.keys[d] for o in others])
+            all_counts = np.concatenate([self.counts[d]] + [s * o.counts[d] for s, o in zip(signs, others)])
+            depth_keys, index = np.unique(all_keys, return_inverse=True)
+            depth_counts = np.zeros((len(depth_keys), self.m), dtype=np.int64)
+            np.add.at(depth_counts, index, all_counts)
+            keep = depth_counts.any(axis=1)
+            keys.append(depth_keys[keep])
+            counts.append(depth_counts[keep])
+        return ContextCounts(self.m, self.D, keys, counts)
+
+    def __add__(self, other):
+        return self.merge(other)
+
+    def __sub__(self, other):
+        return self.merge(other, signs=[-1])
+
+    def truncate(self, D):
+        """
+        Returns:
+            ContextCounts: the counts of the contexts of depth < D, ie. the counts of a tree of depth D.
+        """
+        return ContextCounts(self.m, D, self.keys[:D], self.counts[:D])
+
+    def to_tree(self, node_builder, top=None):
+        """Build (or fill) a node tree with these counts.
+        Args:
+            node_builder ((int, int) -> Node|None): the node builder, as in tree.build_counts.
+                It can be None when top already holds all the nodes (kTree full tree).
+            top (Node|None): the top node of the tree to fill, a new one is built by default.
+        Returns:
+            Node: the top node of the tree.
+        """
+        m = self.m
+        if top is None:
+            top = node_builder(None, m)
+        for d in range(self.D):
+            divisors = m ** np.arange(d - 1, -1, -1, dtype=np.int64)
+            paths = (self.keys[d][:, None] // divisors) % m if d else np.zeros((len(self.keys[d]), 0), dtype=np.int64)
+            for path, count in zip(paths.tolist(), self.counts[d].tolist()):
+                insert_node = top
+                for c in path:
+                    if insert_node.children[c] is None:
+                        insert_node.children[c] = node_builder(c, m)
+                    insert_node = insert_node.children[c]
+                insert_node.count = tree.new_count(m, count)
+        top.invalidate_stats()
+        return top
+
+    def log_pw(self, beta):
+        """Natural log of the Pw of the top node of the tree of these counts, computed on the arrays
+        depth by depth, without building the tree (see tree.compute_log_probas). It is the log of the
+        evidence of the data under the CTW prior.
+        Args:
+            beta (Fraction): the beta used by some probabilities computations.
+        Returns:
+            float: the natural log of the Pw of the top node, 0 without any count.
+        """
+        table = tree.kt_table(self.m)
+        table.grow(max((int(c.sum(axis=1).max()) for c in self.counts if len(c)), default=0))
+        cum_num = np.array(table.cum_num)
+        cum_den = np.array(table.cum_den)
+        log_beta = math.log(beta)
+        log_1_beta = math.log(1 - beta)
+        child_keys = np.zeros(0, dtype=np.int64)
+        child_log_pw = np.zeros(0)
+        for d in range(self.D - 1, -1, -1):
+            keys = self.keys[d]
+            counts = self.counts[d]
+            log_pe = cum_num[counts].sum(axis=1) - cum_den[counts.sum(axis=1)]
+            parents = np.searchsorted(keys, child_keys // self.m)
+            sub = np.zeros(len(keys))
+            np.add.at(sub, parents, child_log_pw)
+            has_children = np.zeros(len(keys), dtype=bool)
+            has_children[parents] = True
+            log_pw = np.where(has_children, np.logaddexp(log_beta + log_pe, log_1_beta + sub), log_pe)
+            child_keys = keys
+            child_log_pw = log_pw
+        return float(child_log_pw[0]) if len(child_log_pw) else 0.0
+
+    def total(self):
+        """
+        Returns:
+            int: the number of counted symbols at depth 0.
+        """
+        return int(self.counts[0].sum()) if self.D else 0
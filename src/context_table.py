@@ -0,0 +1,135 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+import model_file
+
+
+class ContextTable:
+    def __init__(self, flat, tree_index=0, dense_limit=1 << 22):
+        """Compile a tree into a lookup table keyed by the packed last D-1 symbols.
+        A context window w (the oldest symbol first) is packed as sum(w[j] * m^j), so that
+        the most recent symbol is the most significant digit and all the windows sharing a
+        suffix of the past form a contiguous block of keys.
+
+        Args:
+            flat (FlatTree): the tree, see model_file.FlatTree.from_nodes.
+            tree_index (int=0): the tree of flat to compile.
+            dense_limit (int=1<<22): the largest m^(D-1) for which a dense table is built,
+                above it sorted keys per depth are searched instead.
+        """
+        self.m = flat.m
+        self.L = max(0, flat.D - 1)
+        self.nodes = []
+        self.depths = []
+        self.prefixes = []
+        stack = [(int(flat.roots[tree_index]), 0, 0)]
+        while stack:
+            node, depth, prefix = stack.pop()
+            self.nodes.append(node)
+            self.depths.append(depth)
+            self.prefixes.append(prefix)
+            for symbol, child in enumerate(flat.children[node]):
+                if child >= 0 and depth < self.L:
+                    stack.append((int(child), depth + 1, prefix * self.m + symbol))
+        self.nodes = np.array(self.nodes, dtype=np.int64)
+        self.depths = np.array(self.depths, dtype=np.int64)
+        self.prefixes = np.array(self.prefixes, dtype=np.int64)
+        # row i of probas is the predictive distribution of self.nodes[i]
+        self.probas = flat.predictive(self.nodes)
+        self.powers = self.m ** np.arange(self.L, dtype=np.int64)
+
+        self.size = self.m ** self.L
+        self.table = None
+        self.keys = None
+        self.rows = None
+        if self.size <= dense_limit:
+            self.table = np.zeros(self.size, dtype=np.int32)
+            # shallow nodes first so that deeper nodes overwrite their block
+            for row in np.argsort(self.depths, kind="stable"):
+                width = self.m ** (self.L - self.depths[row])
+                start = self.prefixes[row] * width
+                self.table[start:start + width] = row
+        else:
+            if self.L * np.log2(self.m) >= 63:
+                raise ValueError("contexts of {} symbols over {} do not fit in 64 bits".format(self.L, self.m))
+            self.keys = []
+            self.rows = []
+            for depth in range(self.L + 1):
+                rows = np.flatnonzero(self.depths == depth)
+                order = np.argsort(self.prefixes[rows])
+                self.keys.append(self.prefixes[rows][order])
+                self.rows.append(rows[order])
+
+    def pack(self, windows):
+        """Pack context windows into keys.
+        Args:
+            windows (np.ndarray): (B, D-1) past symbols, the most recent being the last column.
+        Returns:
+            np.ndarray: the key of each window.
+        """
+        return np.asarray(windows, dtype=np.int64) @ self.powers
+
+    def lookup(self, keys):
+        """
+        Returns:
+            np.ndarray: the row in probas of each key.
+        """
+        keys = np.asarray(keys, dtype=np.int64)
+        if self.table is not None:
+            return self.table[keys]
+        rows = np.full(keys.shape, -1, dtype=np.int64)
+        for depth in range(self.L, -1, -1):
+            missing = rows < 0
+            if not missing.any():
+                break
+            truncated = keys[missing] // self.m ** (self.L - depth)
+            depth_keys = self.keys[depth]
+            if len(depth_keys) == 0:
+                continue
+            found = np.minimum(np.searchsorted(depth_keys, truncated), len(depth_keys) - 1)
+            ok = depth_keys[found] == truncated
+            index = np.flatnonzero(missing)[ok]
+            rows[index] = self.rows[depth][found[ok]]
+        return rows
+
+    def predict(self, windows):
+        """Next symbol distributions of full context windows.
+        Args:
+            windows (np.ndarray): (B, D-1) past symbols, the most recent being the last column.
+        Returns:
+            np.ndarray: (B, m) the distribution of each window.
+        """
+        return self.probas[self.lookup(self.pack(windows))]
+
+    def history_keys(self, history):
+        """
+        Returns:
+            np.ndarray: the key of the context of each position t >= D-1 of history.
+        """
+        history = np.asarray(history, dtype=np.int64)
+        if len(history) <= self.L:
+            return np.zeros(0, dtype=np.int64)
+        if self.L == 0:
+            return np.zeros(len(history), dtype=np.int64)
+        return sliding_window_view(history[:-1], self.L) @ self.powers
+
+    def predict_history(self, history):
+        """Next symbol distributions along a whole series.
+        Args:
+            history ([int]): the series.
+        Returns:
+            np.ndarray: (len(history) - D + 1, m) the distribution of history[t] given its D-1 previous
+                symbols, for each t >= D-1.
+        """
+        return self.probas[self.lookup(self.history_keys(history))]
+
+
+def compile_tree(top, D, beta=None):
+    """Compile a pruned node tree, for instance the result of prob_tree.prune_tree_main.
+    Args:
+        top (Node): the top node of the tree.
+        D (int): the depth of the tree, also the size of the context.
+        beta (Fraction|None): the beta used by the probabilities computations.
+    Returns:
+        ContextTable: the compiled tree.
+    """
+    return ContextTable(model_file.FlatTree.from_nodes([top], model_file.KIND_MAP, beta, D))
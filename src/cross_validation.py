@@ -0,0 +1,145 @@
+from concurrent.futures import ProcessPoolExecutor
+from fractions import Fraction
+import itertools
+import math
+import sys
+import numpy as np
+from context_counts import ContextCounts
+from data import Data
+import context_table
+import evaluation
+import kTree
+import model_file
+import prob_tree
+
+
+def contiguous_folds(n, n_folds):
+    """Split range(n) into n_folds contiguous folds.
+    Returns:
+        [(int, int)]: the start and end (excluded) of each fold.
+    """
+    bounds = [n * i // n_folds for i in range(n_folds + 1)]
+    return list(zip(bounds, bounds[1:]))
+
+
+def fold_counts(data, m, D, folds):
+    """Count each fold separately, contexts never crossing a fold boundary.
+    Returns:
+        [ContextCounts]: the counts of each fold.
+    """
+    return [ContextCounts.count(data, m, D, t_lo=lo, t_hi=hi, start_lo=lo) for lo, hi in folds]
+
+
+def mixture_probas(trees, D, beta, history):
+    """Next symbol distributions along a series, averaged over some trees.
+    Args:
+        trees ([(Node, float)]): the trees and the natural log of their (unnormalized) posterior weights.
+        D (int): the depth of the trees, also the size of the context.
+        beta (Fraction): the beta used by some probabilities computations.
+        history ([int]): the series.
+    Returns:
+        np.ndarray: see context_table.ContextTable.predict_history.
+    """
+    trees = [(t, pm) for t, pm in trees if pm > -math.inf]
+    log_weights = np.array([pm for _, pm in trees])
+    weights = np.exp(log_weights - log_weights.max())
+    weights /= weights.sum()
+    flat = model_file.FlatTree.from_nodes([t for t, _ in trees], model_file.KIND_KBEST, beta, D)
+    return sum(w * context_table.ContextTable(flat, i).predict_history(history) for i, w in enumerate(weights))
+
+
+def evaluate_config(train, D, beta, k, test, history):
+    """Fit a configuration on training counts and compute its held-out log-loss.
+    Args:
+        train (ContextCounts): the training counts, of depth >= D.
+        D (int): the depth of the tree, also the size of the context.
+        beta (Fraction): the beta used by some probabilities computations.
+        k (int): 1 for the MAP tree, else the predictions are averaged over the k best trees.
+        test ([int]): the held-out symbols.
+        history ([int]): the symbols preceding test, used as context only.
+    Returns:
+        Evaluation: the held-out scores.
+    """
+    counts = train.truncate(D)
+    if k == 1:
+        top = prob_tree.prune_counts_main(counts, beta)
+        return evaluation.evaluate(context_table.compile_tree(top, D, beta), test, history=history)
+    _, trees = kTree.ktree_counts_main(counts, k, beta)
+    context = np.asarray(history, dtype=np.int64)[len(history) - min(len(history), D - 1):]
+    series = np.concatenate([context, np.asarray(test, dtype=np.int64)])
+    probas = mixture_probas(trees, D, beta, series)
+    return evaluation.evaluate_probas(probas, series[len(series) - len(probas):])
+
+
+class CrossValidation:
+    def __init__(self, configs, scores):
+        """Result of a cross-validation.
+
+        Args:
+            configs ([(int, Fraction, int)]): the (D, beta, k) configurations.
+            scores ([[Evaluation]]): for each configuration, the held-out scores of each fold.
+        """
+        self.configs = configs
+        self.scores = scores
+
+    def average_log_loss(self, i):
+        """
+        Returns:
+            float: the held-out log-loss per symbol of the configuration i, over all folds.
+        """
+        n = sum(s.n for s in self.scores[i])
+        return sum(s.total_log_loss for s in self.scores[i]) / n if n else math.inf
+
+    def best(self):
+        """
+        Returns:
+            (int, Fraction, int): the configuration with the smallest held-out log-loss.
+        """
+        return min(zip(self.configs, range(len(self.configs))), key=lambda c: self.average_log_loss(c[1]))[0]
+
+
+def cross_validate(data, m, Ds, betas, ks=(1,), n_folds=5, processes=None):
+    """Parallel k-fold cross-validation over a grid of (D, beta, k). The series is split into
+    contiguous folds counted once at the largest D. The training counts of a fold are the total
+    counts minus its own, truncated to each D, so no configuration recounts the data.
+    Args:
+        data ([int]): the series.
+        m (int): the alphabet size.
+        Ds ([int]): the depths to try.
+        betas ([Fraction]): the betas to try.
+        ks ([int]=(1,)): the numbers of best trees to average (1 for the MAP tree) to try.
+        n_folds (int=5): the number of folds.
+        processes (int|None): the number of worker processes, 1 to evaluate in this process.
+    Returns:
+        CrossValidation: the held-out scores of every configuration, see CrossValidation.best.
+    """
+    configs = list(itertools.product(Ds, betas, ks))
+    D_max = max(Ds)
+    folds = contiguous_folds(len(data), n_folds)
+    counts = fold_counts(data, m, D_max, folds)
+    total = counts[0].merge(*counts[1:])
+    trains = [total - c for c in counts]
+
+    tasks = []
+    for D, beta, k in configs:
+        for (lo, hi), train in zip(folds, trains):
+            tasks.append((train, D, beta, k, data[lo:hi], data[max(0, lo - D_max):lo]))
+
+    if processes == 1:
+        results = [evaluate_config(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(evaluate_config, *zip(*tasks)))
+
+    scores = [results[i * n_folds:(i + 1) * n_folds] for i in range(len(configs))]
+    return CrossValidation(configs, scores)
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "./return_class_train.txt"
+    data_ = Data(path)
+    cv = cross_validate(data_.data, data_.m, Ds=[3, 4, 5, 6], betas=[Fraction(1, 4), Fraction(1, 2), Fraction(3, 4)])
+    print("D\tbeta\tk\tlog_loss")
+    for i, (D, beta, k) in enumerate(cv.configs):
+        print("{}\t{}\t{}\t{:.6f}".format(D, beta, k, cv.average_log_loss(i)))
+    print("best (D, beta, k) = {}".format(cv.best()))
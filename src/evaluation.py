@@ -0,0 +1,104 @@
+import numpy as np
+import context_table
+import model_file
+
+
+class Evaluation:
+    def __init__(self, n, total_log_loss, accuracy, calibration):
+        """Sequential predictive scores of a tree on a test series.
+
+        Args:
+            n (int): the number of predicted symbols.
+            total_log_loss (float): -sum(log2 P(x_t | context)), in bits.
+            accuracy (float): the ratio of symbols equal to the most probable prediction.
+            calibration ([(float, float, int)]): for each confidence bin with predictions in it, the mean
+                probability of the predicted symbol, the accuracy and the number of predictions.
+        """
+        self.n = n
+        self.total_log_loss = total_log_loss
+        self.average_log_loss = total_log_loss / n if n else float("nan")
+        self.accuracy = accuracy
+        self.calibration = calibration
+
+    def expected_calibration_error(self):
+        """
+        Returns:
+            float: the mean gap between confidence and accuracy, weighted by the size of the bins.
+        """
+        if not self.n:
+            return float("nan")
+        return sum(count * abs(conf - acc) for conf, acc, count in self.calibration) / self.n
+
+    def __repr__(self):
+        return "Evaluation(n={}, average_log_loss={:.6f}, accuracy={:.4f}, ece={:.4f})".format(
+            self.n, self.average_log_loss, self.accuracy, self.expected_calibration_error())
+
+
+def as_table(model, D=None):
+    """Get a ContextTable out of a ContextTable, a FlatTree or a pruned node tree.
+    Args:
+        model (ContextTable|FlatTree|Node): the fitted tree. Any model with the L attribute and
+            the predict_history method of ContextTable is used as is.
+        D (int|None): the depth of the tree, required for a node tree.
+    Returns:
+        ContextTable: the compiled tree.
+    """
+    if hasattr(model, "predict_history"):
+        return model
+    if isinstance(model, model_file.FlatTree):
+        return context_table.ContextTable(model)
+    if D is None:
+        raise ValueError("D is required to evaluate a node tree")
+    return context_table.compile_tree(model, D)
+
+
+def evaluate_probas(probas, symbols, bins=10):
+    """Score predicted distributions against the actual symbols.
+    Args:
+        probas (np.ndarray): (n, m) the predicted distributions.
+        symbols (np.ndarray): (n,) the actual symbols.
+        bins (int=10): the number of confidence bins of the calibration.
+    Returns:
+        Evaluation: the scores.
+    """
+    symbols = np.asarray(symbols, dtype=np.int64)
+    n = len(symbols)
+    if n == 0:
+        return Evaluation(0, 0.0, float("nan"), [])
+    p = probas[np.arange(n), symbols]
+    total = float(-np.log2(p).sum())
+
+    predicted = probas.argmax(axis=1)
+    correct = predicted == symbols
+    confidence = probas[np.arange(n), predicted]
+    which = np.minimum((confidence * bins).astype(np.int64), bins - 1)
+    counts = np.bincount(which, minlength=bins)
+    conf_sums = np.bincount(which, weights=confidence, minlength=bins)
+    correct_sums = np.bincount(which, weights=correct, minlength=bins)
+    calibration = [(float(conf_sums[b] / counts[b]), float(correct_sums[b] / counts[b]), int(counts[b]))
+                   for b in range(bins) if counts[b]]
+    return Evaluation(n, total, float(correct.mean()), calibration)
+
+
+def evaluate(model, test, D=None, history=None, bins=10):
+    """Compute the sequential predictive log-loss, accuracy and calibration of a fitted tree
+    on a held-out series, in one vectorized pass.
+    Args:
+        model (ContextTable|FlatTree|Node): the fitted tree, see as_table.
+        test ([int]): the test series.
+        D (int|None): the depth of the tree, required for a node tree.
+        history ([int]|None): the symbols preceding test. Without it the D-1 first symbols
+            of test are only used as context.
+        bins (int=10): the number of confidence bins of the calibration.
+    Returns:
+        Evaluation: the scores.
+    """
+    table = as_table(model, D)
+    test = np.asarray(test, dtype=np.int64)
+    if history is not None and table.L:
+        history = np.asarray(history, dtype=np.int64)[-table.L:]
+        series = np.concatenate([history, test])
+    else:
+        series = test
+    probas = table.predict_history(series)
+    return evaluate_probas(probas, series[len(series) - len(probas):], bins)
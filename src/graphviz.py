@@ -1,3 +1,4 @@
+import math
 import subprocess
 import sys
 import tree
@@ -18,13 +19,16 @@ class GraphvizDrawer:
         self.counter += 1
         return "name{}".format(i)
 
-    def add_node(self, name, label,max_index):
+    def add_node(self, name, label,max_index, fill=None):
         """Add a node to the graph.
         Params:
             name (string): the name of the node.
             label (string): the label of the node.
+            fill (string|None): the fill color of the node.
         """
-        if(max_index==0):
+        if fill is not None:
+            self.s += "\t{} [style=filled, fillcolor=\"{}\", label=\"{}\"];\n".format(name, fill, label)
+        elif(max_index==0):
             self.s += "\t{} [fontcolor=red, label=\"{}\"];\n".format(name, label)
         elif(max_index==1):
             self.s += "\t{} [fontcolor=orange, label=\"{}\"];\n".format(name, label)
@@ -77,12 +81,11 @@ class GraphvizDrawer:
             max_index=node.count.index(max(node.count))
         else:
             max_index=5
-        self.add_node(name, label, max_index)
+        self.add_node(name, label, max_index, node.graphviz_fill())
 
-        for c in node.children:
-            if c is not None:
-                sub_name = self.add_tree_node(c, only_struct)
-                self.add_edge(name, sub_name, c.value)
+        for c in node.iter_children():
+            sub_name = self.add_tree_node(c, only_struct)
+            self.add_edge(name, sub_name, c.value)
         return name
 
     def build(self):
@@ -100,6 +103,15 @@ def str_fraction(f):
     """Utility fonction to print fractions."""
     return float(f) if f else 0.0
 
+def str_count(count):
+    """Utility fonction to print counts (compact arrays or sparse lists)."""
+    return list(count)
+
+def probability_color(p):
+    """Utility fonction to color a probability, from white (0) to red (1)."""
+    level = int(round(255 * (1 - min(max(p, 0.0), 1.0))))
+    return "#ff{:02x}{:02x}".format(level, level)
+
 def str_matrix(Bs):
     """Utility fonction to print matrix (mainly Bs)."""
     res = "\\n"
@@ -125,12 +137,14 @@ def main_node_to_graphviz(node, only_struct=False):
     drawer.add_tree_node(node, only_struct)
     return drawer.build()
 
-def multiple_trees_to_html(trees, only_struct=False):
+def multiple_trees_to_html(trees, only_struct=False, log_probs=False):
     """Get html page from multiple trees. Requires dot to be installed and in path.
     Args:
         trees ([(Node, Fraction)]): the trees and probabilities to display.
         only_struct (bool=False): allows to not draw the label of the node.
             Used to only show the structure of the tree.
+        log_probs (bool=False): the probabilities are natural logs (as given by Node.log_pi_T_x)
+            instead of Fractions.
     Returns:
         string: the content of the html page.
     """
@@ -155,6 +169,11 @@ def multiple_trees_to_html(trees, only_struct=False):
         return "".join(lines)
     
     def proba_desc(best, prob):
+        if log_probs:
+            if best is None:
+                return "log pi(T|x) = {}".format(prob)
+            else:
+                return "Ratio probas = {}".format(math.exp(best - prob))
         if best is None:
             return "pi(T|x) = {}".format(float(prob))
         else:
@@ -25,41 +25,107 @@ def ij_iterator(kj, m):
                 yield (*left, i)
 
 
+class KTreePool:
+    def __init__(self, k, m, capacity=1):
+        """Contiguous storage of the k-tree algorithm state of many KTreeNode, indexed by node id.
+
+        Args:
+            k (int): the number of trees requested.
+            m (int): the alphabet size.
+            capacity (int=1): the number of nodes to allocate room for, the arrays grow when needed.
+        """
+        self.k = k
+        self.m = m
+        self.size = 0
+        # pms[i, j]: natural log of the Pm of the j-th best subtree of node i, -inf when there is none
+        self.pms = np.full((capacity, k), -np.inf)
+        # Bs[i, j]: the 1-based ranks of the children subtrees of the j-th best subtree of node i,
+        # all 0 when it is a leaf, -1 when there is none
+        self.Bs = np.full((capacity, k, m), -1, dtype=np.int32)
+        # kjs[i]: the kj of node i, the number of its subtrees ranked by build_matrix
+        self.kjs = np.zeros(capacity, dtype=np.int32)
+
+    def allocate(self):
+        """
+        Returns:
+            int: the id of a new node.
+        """
+        if self.size == len(self.pms):
+            capacity = 2 * len(self.pms)
+            pms = np.full((capacity, self.k), -np.inf)
+            pms[:self.size] = self.pms
+            Bs = np.full((capacity, self.k, self.m), -1, dtype=np.int32)
+            Bs[:self.size] = self.Bs
+            kjs = np.zeros(capacity, dtype=np.int32)
+            kjs[:self.size] = self.kjs
+            self.pms = pms
+            self.Bs = Bs
+            self.kjs = kjs
+        self.size += 1
+        return self.size - 1
+
+
 class KTreeNode(tree.Node):
-    def __init__(self, value, m, k):
+    __slots__ = ("k", "pool", "id")
+
+    def __init__(self, value, m, k, pool=None):
         """Constructs a KTreeNode to be used in a tree.
 
         Args:
             value (int|None): The value to be stored in this node.
             m (int): the alphabet size.
             k (int): the number of trees requested.
+            pool (KTreePool|None): the storage of the pms and Bs of the node, a new one by default.
         """
         super().__init__(value, m)
         self.k = k
-        self.pms = [Fraction(0) for _ in range(k)]
-        self.Bs = np.full((k, m), -1)
+        self.pool = pool if pool is not None else KTreePool(k, m)
+        self.id = self.pool.allocate()
 
-    def clone_without_children(self):
-        """Clone this node without its children.
-        Returns:
-            KTreeNode: a node with the same value, m, k, count, pe, pms and Bs but without children.
-        """
-        node = KTreeNode(self.value, self.m, self.k)
-        node.count = list(c for c in self.count)
-        node.pe = self.pe
-        node.pms = list(p for p in self.pms)
-        node.Bs = np.copy(self.Bs)
-        return node
+    @property
+    def pms(self):
+        """np.ndarray: the natural logs of the Pm of the k best subtrees of this node (a view on the pool)."""
+        return self.pool.pms[self.id]
+
+    @property
+    def Bs(self):
+        """np.ndarray: the (k, m) ranks of the children of the k best subtrees of this node (a view on the pool)."""
+        return self.pool.Bs[self.id]
 
     def graphviz_label(self):
         return [
-            ("log(pe)", "pe", lambda value: tree.log10_fraction(value)),
-            ("as", "count", None),
-            ("pms", "pms", graphviz.str_fraction_array),
+            ("log(pe)", "pe", tree.log_fraction),
+            ("as", "count", graphviz.str_count),
+            ("log(pms)", "pms", graphviz.str_fraction_array),
             ("Bs", "Bs", graphviz.str_matrix)
         ]
 
 
+class KTreeView(KTreeNode):
+    __slots__ = ("rank",)
+
+    def __init__(self, source, rank):
+        """Constructs a node of an extracted tree: the rank-th best subtree of a node of the full tree.
+        The view shares the counts and the pool row of its source node, only its children are its own.
+        Views are shared between the extracted trees, see extract_tree, so they must not be modified.
+
+        Args:
+            source (KTreeNode): the node of the full tree.
+            rank (int): the 0-based rank of the subtree of source.
+        """
+        self.m = source.m
+        self.value = source.value
+        self.children = tree.new_children(source.m)
+        self.count = source.count
+        self.pe = source.pe
+        self.pw = source.pw
+        self._stats = None
+        self.k = source.k
+        self.pool = source.pool
+        self.id = source.id
+        self.rank = rank
+
+
 def build_full_tree(m, k, D):
     """Build a new m-ary tree of depth D.
     Args:
@@ -69,8 +135,10 @@ def build_full_tree(m, k, D):
     Returns:
         KTreeNode: the top node of the tree.
     """
+    pool = KTreePool(k, m, sum(m ** d for d in range(D)))
+
     def build_node(value, m, k, depth_to_go):
-        node = KTreeNode(value, m, k)
+        node = KTreeNode(value, m, k, pool)
         if depth_to_go != 0:
             children = list(build_node(i, m, k, depth_to_go - 1)
                             for i in range(m))
@@ -79,29 +147,36 @@ def build_full_tree(m, k, D):
     return build_node(None, m, k, D - 1)
 
 
-def build_matrix(node, m, k, D, beta):
+def build_matrix(node, m, k, D, beta, dirty=None):
     """Compute k-tree algorithm matrices for each node of the tree.
     Args:
         node (KTreeNode): the top node of the tree.
         m (int): the alphabet size.
         k (int): the number of trees requested.
         D (int): the depth of the tree.
+        dirty (set|None): the ids of the nodes to recompute, the other ones keeping the matrices of
+            a previous call. All the nodes are computed when None.
     Returns:
         int: the kj of this node.
     """
+    if dirty is not None and node.id not in dirty:
+        return int(node.pool.kjs[node.id])
     if node.is_leaf():
-        node.pms[0] = node.pe
-        node.Bs[0] = np.zeros((1, m), dtype=np.int64)
+        node.pms[0] = node.log_pe()
+        node.Bs[0] = 0
+        node.pool.kjs[node.id] = 1
         return 1
     else:
-        kjs = [build_matrix(c, m, k, D, beta) for c in node.children]
+        kjs = [build_matrix(c, m, k, D, beta, dirty) for c in node.children]
         kj = min(kjs)
 
-        probas = [(beta * node.pe, np.zeros((1, m)))]
+        children_pms = [c.pms for c in node.children]
+        probas = [(math.log(beta) + node.log_pe(), np.zeros(m))]
+        log_1_beta = math.log(1 - beta)
         for ijs in ij_iterator(kj, m):
-            p = 1 - beta
+            p = log_1_beta
             for j in range(m):
-                p *= node.children[j].pms[ijs[j] - 1]
+                p += children_pms[j][ijs[j] - 1]
             probas.append((p, np.array(ijs)))
 
         # sort by proba in desc order
@@ -111,30 +186,37 @@ def build_matrix(node, m, k, D, beta):
             node.pms[i] = prob
             node.Bs[i] = vec
         # assert node.Bs.shape == (k, m)
+        node.pool.kjs[node.id] = min(k, kj + 1)
         return min(k, kj + 1)
 
 
-def extract_tree(node, ki):
+def extract_tree(node, ki, cache=None):
     """Extracts the ki best-tree.
     Args:
         node (KTreeNode): the top node of the tree.
         ki (int): the 0-based index of the tree requested. 0 <= ki < k
+        cache (dict|None): the views already extracted by (node id, rank). Passing the same
+            dict to several calls makes the extracted trees share their identical subtrees.
     Returns:
-        (KNodeTree, Fraction): the ki-best tree and the Pm associated with it
+        (KTreeView, float): the ki-best tree and the natural log of the Pm associated with it
     """
+    if cache is None:
+        cache = {}
+
     def inner(node, ki):
         """Extracts the ki best-tree. This function only returns the tree."""
-        row = node.Bs[ki]
-        new_node = node.clone_without_children()
-        if all(elem == 0 for elem in row):
-            return new_node
-        else:
-            new_children = list(inner(c, int(r) - 1)
-                                for c, r in zip(node.children, row))
-            new_node.children = new_children
-            return new_node
+        key = (node.id, ki)
+        view = cache.get(key)
+        if view is None:
+            view = KTreeView(node, ki)
+            row = node.Bs[ki]
+            if any(row):
+                for j, (c, r) in enumerate(zip(node.children, row)):
+                    view.children[j] = inner(c, int(r) - 1)
+            cache[key] = view
+        return view
     ki_tree = inner(node, ki)
-    pm = ki_tree.pms[ki]
+    pm = float(ki_tree.pms[ki])
     return (ki_tree, pm)
 
 
@@ -147,7 +229,8 @@ def ktree_main(data, m, D, k, beta):
         k (int): the number of trees requested.
         beta (Fraction): the beta used by some probabilities computations.
     Returns:
-        [KNodeTree]: returns the full tree and all k best trees
+        [KNodeTree]: returns the full tree and the k best trees (less if there are less than k trees),
+            sharing their identical subtrees
     """
     tree.debug("Building full tree")
     top = build_full_tree(m, k, D)
@@ -162,9 +245,81 @@ def ktree_main(data, m, D, k, beta):
     build_matrix(top, m, k, D, beta)
 
     trees = []
+    cache = {}
+    for score in range(k):
+        if top.pms[score] == -math.inf:
+            break
+        tree.debug("Extracting tree {}".format(score))
+        next_tree = extract_tree(top, score, cache)
+        trees.append(next_tree)
+    return (top, trees)
+
+
+def ktree_counts_main(counts, k, beta):
+    """ktree algorithm on already computed counts.
+    Args:
+        counts (ContextCounts): the counts of the contexts, see context_counts.
+        k (int): the number of trees requested.
+        beta (Fraction): the beta used by some probabilities computations.
+    Returns:
+        [KNodeTree]: returns the full tree and the k best trees (less if there are less than k trees)
+    """
+    m, D = counts.m, counts.D
+    tree.debug("Building full tree")
+    top = build_full_tree(m, k, D)
+
+    tree.debug("Filling counts")
+    counts.to_tree(None, top)
+
+    tree.debug("Computing probas")
+    top.compute_probas(beta)
+
+    tree.debug("Building matrix")
+    build_matrix(top, m, k, D, beta)
+
+    trees = []
+    cache = {}
+    for score in range(k):
+        if top.pms[score] == -math.inf:
+            break
+        tree.debug("Extracting tree {}".format(score))
+        next_tree = extract_tree(top, score, cache)
+        trees.append(next_tree)
+    return (top, trees)
+
+
+def ktree_update(top, new_symbols, tail_context, D, k, beta):
+    """Append new data to the full tree of ktree_main and refresh the k best trees. Only the nodes
+    whose counts changed, on the paths of the new positions, get new probabilities and matrices.
+    The trees extracted before the update share the matrices of the full tree, they are stale after it.
+    Args:
+        top (KTreeNode): the full tree, as returned by ktree_main.
+        new_symbols ([int]): the new data.
+        tail_context ([int]): the data already in the tree, at least its last D-1 symbols.
+        D (int): the depth of the tree, also the size of the context.
+        k (int): the number of trees requested.
+        beta (Fraction): the beta used by some probabilities computations.
+    Returns:
+        [KNodeTree]: returns the full tree and the k best trees (less if there are less than k trees)
+    """
+    m = top.m
+    tree.debug("Adding counts")
+    touched = tree.add_counts(top, new_symbols, D, None, tail_context)
+
+    tree.debug("Computing probas of {} nodes".format(len(touched)))
+    for node in touched:
+        node.pw = node.get_pw(beta)
+
+    tree.debug("Building matrix")
+    build_matrix(top, m, k, D, beta, set(node.id for node in touched))
+
+    trees = []
+    cache = {}
     for score in range(k):
+        if top.pms[score] == -math.inf:
+            break
         tree.debug("Extracting tree {}".format(score))
-        next_tree = extract_tree(top, score)
+        next_tree = extract_tree(top, score, cache)
         trees.append(next_tree)
     return (top, trees)
 
@@ -185,9 +340,9 @@ if __name__ == "__main__":
     top, trees = ktree_main(data.data, m=data.m, D=D, k=5, beta=beta)
 
     if len(sys.argv) > 1 and sys.argv[1] == "html":
-        pw = top.pw
-        trees_probs = [(t, t.compute_pi_T_x(beta, D, pw)) for t, _ in trees]
-        print(graphviz.multiple_trees_to_html(trees_probs, only_struct=True))
+        log_pw = tree.log_fraction(top.pw)
+        trees_probs = [(t, t.log_pi_T_x(beta, D, log_pw)) for t, _ in trees]
+        print(graphviz.multiple_trees_to_html(trees_probs, only_struct=True, log_probs=True))
     else:
         for tree, _ in trees:
             print(graphviz.main_node_to_graphviz(tree))
@@ -0,0 +1,242 @@
+from fractions import Fraction
+import heapq
+import itertools
+import math
+import sys
+from data import Data
+import graphviz
+import tree
+
+
+class RankedView(tree.Node):
+    __slots__ = ("rank", "log_pm")
+
+    def __init__(self, source, rank, log_pm):
+        """Constructs a node of an enumerated tree: the rank-th best subtree of a node of the count tree.
+        The view shares the counts of its source node, only its children are its own. Views are
+        shared between the enumerated trees, so they must not be modified.
+
+        Args:
+            source (Node): the node of the count tree.
+            rank (int): the 0-based rank of the subtree of source.
+            log_pm (float): the natural log of the Pm of the subtree.
+        """
+        self.m = source.m
+        self.value = source.value
+        self.children = tree.new_children(source.m)
+        self.count = source.count
+        self.pe = source.pe
+        self.pw = source.pw
+        self._stats = None
+        self.rank = rank
+        self.log_pm = log_pm
+
+    def graphviz_label(self):
+        return [
+            ("as", "count", graphviz.str_count),
+            ("rank", "rank", None),
+            ("log(pm)", "log_pm", None)
+        ]
+
+
+class _NodeState:
+    __slots__ = ("children", "derivations", "heap", "seen", "pending")
+
+    def __init__(self, children):
+        self.children = children
+        # [(log pm, ranks)] the best subtrees of the node found so far, in desc order,
+        # ranks being None when the node is a leaf of the subtree
+        self.derivations = []
+        # [(-log pm, tie breaker, ranks)] the candidates for the next best subtree
+        self.heap = []
+        self.seen = set()
+        # ranks of the last derivation whose successors are not candidates yet
+        self.pending = None
+
+
+class LazyKBest:
+    def __init__(self, top, beta):
+        """Lazy enumeration of the best pruned subtrees of a context tree, by decreasing Pm, with the
+        lazy k-best algorithm of Huang and Chiang: a node only computes its next best subtree when
+        its parent asks for it, so asking for the next tree only explores a few paths.
+
+        A pruned subtree either stops at a node, with Pm = beta * Pe (Pe alone at the leaves of
+        the count tree), or keeps all its existing children, with Pm = (1 - beta) * product of
+        the Pm of their subtrees. The missing children are ignored as in prob_tree, so the first
+        tree is the MAP tree of prob_tree.prune_tree_main. On the full tree of kTree.build_full_tree
+        every pruned subtree is enumerated, the trees of kTree.ktree_main being among them.
+
+        Args:
+            top (Node): the top node of the count tree.
+            beta (Fraction): the beta used by some probabilities computations.
+        """
+        self.top = top
+        self.log_beta = math.log(beta)
+        self.log_1_beta = math.log(1 - beta)
+        self.beta = beta
+        self._states = {}
+        self._views = {}
+        self._counter = itertools.count()
+        self._log_pw = None
+
+    def log_pw(self):
+        """
+        Returns:
+            float: the natural log of the Pw of the top node, the sum of the Pm of all the trees
+                enumerated, ie. the normalizer of their posterior probability pi(T|x).
+        """
+        if self._log_pw is None:
+            self._log_pw = tree.compute_log_probas(self.top, self.beta)[id(self.top)][1]
+        return self._log_pw
+
+    def _state(self, node):
+        state = self._states.get(id(node))
+        if state is None:
+            children = list(node.iter_children())
+            state = _NodeState(children)
+            log_pe = node.log_pe()
+            if not children:
+                self._push(state, log_pe, None)
+            else:
+                self._push(state, self.log_beta + log_pe, None)
+                self._push_split(state, (0,) * len(children))
+            self._states[id(node)] = state
+        return state
+
+    def _push(self, state, log_pm, ranks):
+        heapq.heappush(state.heap, (-log_pm, next(self._counter), ranks))
+
+    def _push_split(self, state, ranks):
+        if ranks in state.seen:
+            return
+        state.seen.add(ranks)
+        log_pm = self.log_1_beta
+        for c, r in zip(state.children, ranks):
+            derivation = self.get(c, r)
+            if derivation is None:
+                return
+            log_pm += derivation[0]
+        self._push(state, log_pm, ranks)
+
+    def get(self, node, rank):
+        """
+        Args:
+            node (Node): a node of the count tree.
+            rank (int): the 0-based rank of the subtree requested.
+        Returns:
+            (float, (int)|None)|None: the natural log of the Pm of the rank-th best subtree of node and
+                the ranks of the subtrees of its children (None when it stops at node), None if there
+                are not that many subtrees.
+        """
+        state = self._state(node)
+        derivations = state.derivations
+        while len(derivations) <= rank:
+            if state.pending is not None:
+                ranks = state.pending
+                state.pending = None
+                for j in range(len(ranks)):
+                    self._push_split(state, ranks[:j] + (ranks[j] + 1,) + ranks[j + 1:])
+            if not state.heap:
+                return None
+            neg_log_pm, _, ranks = heapq.heappop(state.heap)
+            derivations.append((-neg_log_pm, ranks))
+            state.pending = ranks
+        return derivations[rank]
+
+    def tree(self, rank, node=None):
+        """Build the rank-th best subtree of a node, the trees built share their identical subtrees.
+        Args:
+            rank (int): the 0-based rank of the subtree requested.
+            node (Node|None): a node of the count tree, the top node by default.
+        Returns:
+            RankedView|None: the top node of the subtree, None if there are not that many subtrees.
+        """
+        if node is None:
+            node = self.top
+        key = (id(node), rank)
+        view = self._views.get(key)
+        if view is None:
+            derivation = self.get(node, rank)
+            if derivation is None:
+                return None
+            log_pm, ranks = derivation
+            view = RankedView(node, rank, log_pm)
+            if ranks is not None:
+                for c, r in zip(self._state(node).children, ranks):
+                    view.children[c.value] = self.tree(r, c)
+            self._views[key] = view
+        return view
+
+    def __iter__(self):
+        """
+        Yields:
+            (RankedView, float): the best trees by decreasing Pm and the natural log of their Pm.
+        """
+        for rank in itertools.count():
+            view = self.tree(rank)
+            if view is None:
+                return
+            yield (view, view.log_pm)
+
+
+def posterior_trees(enumeration, mass=0.95, min_ratio=None, max_trees=None):
+    """Enumerate the best trees until they cover a part of the posterior, pi(T|x) being Pm / Pw(top).
+    Args:
+        enumeration (LazyKBest): the enumeration of the trees.
+        mass (float=0.95): stop once the trees enumerated reach this cumulative posterior probability.
+        min_ratio (float|None): stop before the first tree less probable than min_ratio times the MAP tree.
+        max_trees (int|None): stop after this number of trees.
+    Yields:
+        (RankedView, float, float): the trees, the natural log of their pi(T|x) and the cumulative
+            pi(T|x) of the trees yielded so far.
+    """
+    log_pw = enumeration.log_pw()
+    log_min_ratio = math.log(min_ratio) if min_ratio is not None else -math.inf
+    cumulative = 0.0
+    best = None
+    for i, (t, log_pm) in enumerate(enumeration):
+        if max_trees is not None and i >= max_trees:
+            return
+        if best is None:
+            best = log_pm
+        elif log_pm - best < log_min_ratio:
+            return
+        log_posterior = log_pm - log_pw
+        cumulative += math.exp(log_posterior)
+        yield (t, log_posterior, cumulative)
+        if cumulative >= mass:
+            return
+
+
+def lazy_ktree_main(data, m, D, beta):
+    """Main function for the lazy k-best trees enumeration, the number of trees is not needed up front.
+    Args:
+        data ([int]): the input data.
+        m (int): the alphabet size.
+        D (int): the depth of the tree, also the size of the context.
+        beta (Fraction): the beta used by some probabilities computations.
+    Returns:
+        LazyKBest: the enumeration of the best trees, iterate over it to get them.
+    """
+    top = tree.Node(None, m)
+    tree.debug("Building tree")
+    tree.build_counts(top, data, D, lambda value, m: tree.Node(value, m))
+    return LazyKBest(top, beta)
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "./return_class_train.txt"
+    data = Data(path)
+
+    enumeration = lazy_ktree_main(data.data, m=data.m, D=9, beta=Fraction(1, 2))
+    if len(sys.argv) > 2 and sys.argv[2] == "mass":
+        mass = float(sys.argv[3]) if len(sys.argv) > 3 else 0.95
+        trees = list(posterior_trees(enumeration, mass=mass, max_trees=1000))
+        tree.debug("{} trees cover {:.4f} of the posterior".format(len(trees), trees[-1][2]))
+        trees_probs = [(t, log_posterior) for t, log_posterior, _ in trees]
+        print(graphviz.multiple_trees_to_html(trees_probs, only_struct=True, log_probs=True))
+    else:
+        n_trees = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+        for t, log_pm in itertools.islice(enumeration, n_trees):
+            tree.debug("Tree of log(Pm) {}".format(log_pm))
+            print(graphviz.main_node_to_graphviz(t, only_struct=True))
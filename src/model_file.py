@@ -0,0 +1,285 @@
+import math
+import mmap
+import struct
+from fractions import Fraction
+import numpy as np
+import prob_tree
+import tree
+
+MAGIC = b"CTWT"
+VERSION = 2
+
+KIND_COUNTS = 0
+KIND_MAP = 1
+KIND_KBEST = 2
+
+# magic, version, kind, m, D, count width, beta numerator, beta denominator, number of nodes, number of trees
+# (the count width is m, except for the binary_ctw trees that have m children and 2 counts)
+HEADER = struct.Struct("<4sHHIIIQQQQ")
+
+
+class FlatTree:
+    def __init__(self, kind, m, D, beta, roots, scores, values, children, counts, log_pe, log_pw, log_pm):
+        """Flat array representation of one or several trees sharing the same m, D and beta.
+        Node i of the trees is described by the i-th row of each array, the top nodes being given by roots.
+
+        Args:
+            kind (int): KIND_COUNTS, KIND_MAP or KIND_KBEST.
+            m (int): the alphabet size.
+            D (int): the depth of the tree, also the size of the context.
+            beta (Fraction): the beta used by the probabilities computations.
+            roots (np.ndarray): the node index of the top node of each tree.
+            scores (np.ndarray): a log score for each tree (the log Pm of the k-best trees), nan if unknown.
+            values (np.ndarray): the value of each node, -1 for the top nodes.
+            children (np.ndarray): (n, m) child node indexes, -1 when there is no child.
+            counts (np.ndarray): (n, m) the counts of each node (n, 2 for binary_ctw trees).
+            log_pe (np.ndarray): natural log of Pe for each node, nan if unknown.
+            log_pw (np.ndarray): natural log of Pw for each node, nan if unknown.
+            log_pm (np.ndarray): natural log of Pm for each node, nan if unknown.
+        """
+        self.kind = kind
+        self.m = m
+        self.D = D
+        self.beta = beta
+        self.roots = roots
+        self.scores = scores
+        self.values = values
+        self.children = children
+        self.counts = counts
+        self.log_pe = log_pe
+        self.log_pw = log_pw
+        self.log_pm = log_pm
+        self._mmap = None
+
+    @classmethod
+    def from_nodes(cls, tops, kind, beta, D, scores=None):
+        """Flatten node trees.
+        Args:
+            tops ([Node]): the top nodes of the trees.
+            kind (int): KIND_COUNTS, KIND_MAP or KIND_KBEST.
+            beta (Fraction): the beta used by the probabilities computations.
+            D (int): the depth of the tree, also the size of the context.
+            scores ([float]|None): a log score for each tree.
+        Returns:
+            FlatTree: the flattened trees.
+        """
+        m = tops[0].m
+        nodes = []
+        parents = []
+        roots = []
+        for top in tops:
+            roots.append(len(nodes))
+            stack = [(top, -1)]
+            while stack:
+                node, parent = stack.pop()
+                parents.append(parent)
+                index = len(nodes)
+                nodes.append(node)
+                stack.extend((c, index) for c in reversed(list(node.iter_children())))
+
+        n = len(nodes)
+        values = np.full(n, -1, dtype=np.int32)
+        children = np.full((n, m), -1, dtype=np.int32)
+        counts = np.zeros((n, len(tops[0].count)), dtype=np.int64)
+        log_pe = np.full(n, np.nan)
+        log_pw = np.full(n, np.nan)
+        log_pm = np.full(n, np.nan)
+
+        def log_or_nan(f):
+            return tree.log_fraction(f) if f else math.nan
+
+        for i, (node, parent) in enumerate(zip(nodes, parents)):
+            if parent >= 0:
+                values[i] = node.value
+                children[parent, node.value] = i
+            counts[i] = list(node.count)
+            log_pe[i] = node.log_pe() if node.pe is not None else math.nan
+            log_pw[i] = log_or_nan(node.pw)
+            log_pm[i] = log_or_nan(getattr(node, "pm", None))
+
+        if scores is None:
+            scores = [math.nan] * len(tops)
+        return cls(kind, m, D, beta, np.array(roots, dtype=np.int64), np.array(scores, dtype=np.float64),
+                   values, children, counts, log_pe, log_pw, log_pm)
+
+    def __len__(self):
+        """
+        Returns:
+            int: the number of trees.
+        """
+        return len(self.roots)
+
+    def is_leaf(self, i):
+        """
+        Returns:
+            bool: True if the node i has no children.
+        """
+        return bool((self.children[i] < 0).all())
+
+    def find(self, context, tree_index=0):
+        """Walk down a tree following a context, as TreeGenerator.next does.
+        Args:
+            context ([int]): the past symbols, the most recent being the last one.
+            tree_index (int=0): the tree to walk.
+        Returns:
+            int: the index of the deepest node matching the context.
+        """
+        node = int(self.roots[tree_index])
+        for c in reversed(context):
+            child = self.children[node, c]
+            if child < 0:
+                break
+            node = int(child)
+        return node
+
+    def find_batch(self, contexts, lengths=None, tree_index=0):
+        """Vectorized find over many contexts at once.
+        Args:
+            contexts (np.ndarray): (B, L) past symbols, the most recent being the last column.
+            lengths (np.ndarray|None): the number of valid symbols at the end of each row, L for all rows by default.
+            tree_index (int=0): the tree to walk.
+        Returns:
+            np.ndarray: the index of the deepest node matching each context.
+        """
+        contexts = np.asarray(contexts)
+        B, L = contexts.shape
+        nodes = np.full(B, self.roots[tree_index], dtype=np.int64)
+        active = np.ones(B, dtype=bool)
+        for i in range(L):
+            if lengths is not None:
+                active &= i < lengths
+            child = self.children[nodes, contexts[:, L - 1 - i]]
+            active &= child >= 0
+            if not active.any():
+                break
+            nodes = np.where(active, child, nodes)
+        return nodes
+
+    def predictive(self, nodes):
+        """KT predictive distributions, (count[a] + 1/2) / (sum(count) + m/2), of some nodes.
+        Args:
+            nodes (int|np.ndarray): node indexes.
+        Returns:
+            np.ndarray: the next symbol distribution of each node, one row per node.
+        """
+        counts = self.counts[nodes] + 0.5
+        return counts / counts.sum(axis=-1, keepdims=True)
+
+    def predict(self, context, tree_index=0):
+        """
+        Returns:
+            np.ndarray: the next symbol distribution given a context, see find.
+        """
+        return self.predictive(self.find(context, tree_index))
+
+    def to_node(self, tree_index=0, node_builder=None):
+        """Rebuild a node tree, for instance to draw it with graphviz.
+        The Fraction probabilities are not restored, call compute_probas if they are needed.
+        Args:
+            tree_index (int=0): the tree to rebuild.
+            node_builder ((int, int) -> Node): the node builder, ProbNode by default.
+        Returns:
+            Node: the top node of the tree.
+        """
+        if node_builder is None:
+            node_builder = prob_tree.ProbNode
+
+        def inner(i, value):
+            node = node_builder(value, self.m)
+            node.count = tree.new_count(self.counts.shape[1], [int(c) for c in self.counts[i]])
+            for j in np.flatnonzero(self.children[i] >= 0):
+                node.children[int(j)] = inner(int(self.children[i, j]), int(j))
+            return node
+        return inner(int(self.roots[tree_index]), None)
+
+
+def _arrays_layout(m, width, n_nodes, n_trees):
+    """The (name, dtype, shape) of the arrays stored after the header, in file order."""
+    return [
+        ("roots", np.int64, (n_trees,)),
+        ("scores", np.float64, (n_trees,)),
+        ("values", np.int32, (n_nodes,)),
+        ("children", np.int32, (n_nodes, m)),
+        ("counts", np.int64, (n_nodes, width)),
+        ("log_pe", np.float64, (n_nodes,)),
+        ("log_pw", np.float64, (n_nodes,)),
+        ("log_pm", np.float64, (n_nodes,)),
+    ]
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def save(path, flat):
+    """Write flat trees to a binary model file.
+    Args:
+        path (string): the path of the file.
+        flat (FlatTree): the trees to write.
+    """
+    n_nodes = len(flat.values)
+    width = flat.counts.shape[1]
+    beta = Fraction(flat.beta)
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, flat.kind, flat.m, flat.D, width, beta.numerator, beta.denominator,
+                            n_nodes, len(flat.roots)))
+        offset = HEADER.size
+        for name, dtype, shape in _arrays_layout(flat.m, width, n_nodes, len(flat.roots)):
+            padding = _align(offset) - offset
+            f.write(b"\0" * padding)
+            data = np.ascontiguousarray(getattr(flat, name), dtype=dtype).reshape(shape)
+            f.write(data.tobytes())
+            offset += padding + data.nbytes
+
+
+def save_tree(path, top, beta, D, kind=KIND_MAP):
+    """Write a count tree or a pruned MAP tree to a binary model file.
+    Args:
+        path (string): the path of the file.
+        top (Node): the top node of the tree.
+        beta (Fraction): the beta used by the probabilities computations.
+        D (int): the depth of the tree, also the size of the context.
+        kind (int=KIND_MAP): KIND_COUNTS or KIND_MAP.
+    """
+    save(path, FlatTree.from_nodes([top], kind, beta, D))
+
+
+def save_trees(path, trees, beta, D):
+    """Write k-best trees, as returned by kTree.ktree_main, to a binary model file.
+    Args:
+        path (string): the path of the file.
+        trees ([(KTreeNode, float)]): the trees and the natural log of their Pm.
+        beta (Fraction): the beta used by the probabilities computations.
+        D (int): the depth of the tree, also the size of the context.
+    """
+    tops = [t for t, _ in trees]
+    scores = [pm for _, pm in trees]
+    save(path, FlatTree.from_nodes(tops, KIND_KBEST, beta, D, scores))
+
+
+def load(path):
+    """Memory-map a binary model file. The arrays are read-only views over the file.
+    Args:
+        path (string): the path of the file.
+    Returns:
+        FlatTree: the trees stored in the file.
+    """
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, kind, m, D, width, num, den, n_nodes, n_trees = HEADER.unpack_from(mm, 0)
+    if magic != MAGIC:
+        raise ValueError("{} is not a context tree model file".format(path))
+    if version != VERSION:
+        raise ValueError("unsupported model file version {}".format(version))
+
+    arrays = {}
+    offset = HEADER.size
+    for name, dtype, shape in _arrays_layout(m, width, n_nodes, n_trees):
+        offset = _align(offset)
+        size = int(np.prod(shape))
+        arrays[name] = np.frombuffer(mm, dtype=dtype, count=size, offset=offset).reshape(shape)
+        offset += arrays[name].nbytes
+
+    flat = FlatTree(kind, m, D, Fraction(num, den), **arrays)
+    flat._mmap = mm
+    return flat
@@ -0,0 +1,93 @@
+import math
+import tree
+
+
+class OnlineNode(tree.Node):
+    __slots__ = ("total", "log_children")
+
+    def __init__(self, value, m):
+        """Constructs a node of a sequentially updated tree. pe and pw hold natural logs here.
+
+        Args:
+            value (int|None): The value to be stored in this node.
+            m (int): The alphabet size.
+        """
+        super().__init__(value, m)
+        self.pe = 0.0
+        self.pw = 0.0
+        # sum of the counts
+        self.total = 0
+        # sum of the log Pw of the children
+        self.log_children = 0.0
+
+
+class OnlineCTW:
+    def __init__(self, m, D, beta):
+        """Streaming CTW: the counts and the log Pe / Pw of the context tree are updated symbol by
+        symbol along the context path only. After feeding a series, the tree is the tree of
+        tree.build_counts with the probabilities of compute_probas (as natural logs).
+
+        Each node of the path costs O(1): the KT update of Pe is a lookup in tree.KTTable, without
+        any log call, while the mix of Pw takes one tree.logaddexp (a log1p and an exp).
+
+        Args:
+            m (int): the alphabet size.
+            D (int): the depth of the tree, also the size of the context.
+            beta (Fraction): the beta used by some probabilities computations.
+        """
+        self.m = m
+        self.D = D
+        self.log_beta = math.log(beta)
+        self.log_1_beta = math.log(1 - beta)
+        self.table = tree.kt_table(m)
+        self.top = OnlineNode(None, m)
+        self.past = []
+
+    def update(self, value):
+        """Add a symbol.
+        Args:
+            value (int): the new symbol.
+        Returns:
+            float: the natural log of the sequential CTW probability of the symbol given the past.
+        """
+        m = self.m
+        table = self.table
+        path = [self.top]
+        node = self.top
+        for c in reversed(self.past):
+            if node.children[c] is None:
+                node.children[c] = OnlineNode(c, m)
+            node = node.children[c]
+            path.append(node)
+
+        child_delta = 0.0
+        for node in reversed(path):
+            node.pe += table.log_ratio(node.count[value], node.total)
+            node.count[value] += 1
+            node.total += 1
+            node.log_children += child_delta
+            old_pw = node.pw
+            if node.is_leaf():
+                node.pw = node.pe
+            else:
+                node.pw = tree.logaddexp(self.log_beta + node.pe, self.log_1_beta + node.log_children)
+            child_delta = node.pw - old_pw
+
+        self.past.append(value)
+        if len(self.past) >= self.D:
+            del self.past[0]
+        return child_delta
+
+    def update_n(self, values):
+        """Add symbols.
+        Returns:
+            float: the natural log of the sequential CTW probability of the symbols.
+        """
+        return sum(self.update(v) for v in values)
+
+    def log_pw(self):
+        """
+        Returns:
+            float: the natural log of the Pw of the top node, the probability of all the symbols seen.
+        """
+        return self.top.pw
@@ -0,0 +1,261 @@
+from fractions import Fraction
+import math
+import sys
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from data import Data
+import graphviz
+import tree
+
+
+class InclusionNode(tree.Node):
+    __slots__ = ("p_node", "p_leaf")
+
+    def __init__(self, value, m):
+        """Constructs a node of a count tree annotated with its posterior inclusion probabilities.
+
+        Args:
+            value (int|None): The value to be stored in this node.
+            m (int): The alphabet size.
+        """
+        super().__init__(value, m)
+        # posterior probability that the node is in the tree, and that it is a leaf of the tree
+        self.p_node = None
+        self.p_leaf = None
+
+    def graphviz_label(self):
+        return [
+            ("as", "count", graphviz.str_count),
+            ("p(node)", "p_node", lambda p: round(p, 4)),
+            ("p(leaf)", "p_leaf", lambda p: round(p, 4))
+        ]
+
+    def graphviz_fill(self):
+        return graphviz.probability_color(self.p_node)
+
+
+class PosteriorTree:
+    def __init__(self, top, beta):
+        """Posterior distribution pi(T|x) of the pruned subtrees of a count tree. Under it a tree is
+        drawn top-down: starting from the top node, each node stops (is a leaf of the tree) with
+        probability beta * Pe / Pw, or else keeps all its existing children, which are drawn
+        independently. The leaves of the count tree always stop. The trees are the ones of
+        lazy_kbest.LazyKBest, drawn with probability Pm / Pw(top).
+
+        The nodes are stored breadth first, so the nodes of each depth are contiguous.
+
+        Args:
+            top (Node): the top node of the count tree.
+            beta (Fraction): the beta used by some probabilities computations.
+        """
+        log_probas = tree.compute_log_probas(top, beta)
+        log_beta = math.log(beta)
+        self.nodes = [top]
+        parents = [-1]
+        # depth_starts[d]: the index of the first node of depth d + 1 (the top node being at depth 1)
+        self.depth_starts = []
+        start = 0
+        while start < len(self.nodes):
+            self.depth_starts.append(start)
+            end = len(self.nodes)
+            for i in range(start, end):
+                for c in self.nodes[i].iter_children():
+                    self.nodes.append(c)
+                    parents.append(i)
+            start = end
+        self.depth_starts.append(len(self.nodes))
+        self.parents = np.array(parents, dtype=np.int64)
+        self.log_pe = np.array([log_probas[id(n)][0] for n in self.nodes])
+        self.log_pw = np.array([log_probas[id(n)][1] for n in self.nodes])
+        is_leaf = np.array([n.is_leaf() for n in self.nodes])
+        self.stop = np.where(is_leaf, 1.0, np.exp(np.minimum(log_beta + self.log_pe - self.log_pw, 0.0)))
+
+    def depth_slices(self):
+        """
+        Yields:
+            slice: the nodes of each depth, from the top node.
+        """
+        for start, end in zip(self.depth_starts[:-1], self.depth_starts[1:]):
+            yield slice(start, end)
+
+    def sample(self, n, rng=None):
+        """Draw independent trees, all of them at once.
+        Args:
+            n (int): the number of trees.
+            rng (np.random.Generator|None): the random generator, a new one by default.
+        Returns:
+            (np.ndarray, np.ndarray): (n, nodes) booleans, the nodes of each tree and the leaves of each tree.
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+        stopped = rng.random((n, len(self.nodes))) < self.stop
+        included = np.zeros((n, len(self.nodes)), dtype=bool)
+        included[:, 0] = True
+        slices = self.depth_slices()
+        next(slices)
+        for s in slices:
+            parents = self.parents[s]
+            included[:, s] = included[:, parents] & ~stopped[:, parents]
+        return (included, included & stopped)
+
+    def to_tree(self, included):
+        """Build one of the trees drawn.
+        Args:
+            included (np.ndarray): (nodes) booleans, the nodes of the tree, a row of sample.
+        Returns:
+            Node: the top node of the tree, its nodes holding copies of the counts.
+        """
+        copies = {}
+        for i in np.flatnonzero(included):
+            node = self.nodes[i]
+            copy = tree.Node(node.value, node.m)
+            copy.count = tree.new_count(len(node.count), node.count)
+            copies[i] = copy
+            if i > 0:
+                copies[self.parents[i]].children[node.value] = copy
+        return copies[0]
+
+    def inclusion(self):
+        """Posterior marginal probabilities of every node, by a downward pass: a node is in the tree
+        when its parent is and does not stop, then it is a leaf when it stops.
+        Returns:
+            (np.ndarray, np.ndarray): the probability that each node is in the tree, and that it is
+                a leaf of the tree. The probability that it is an internal node is their difference.
+        """
+        p_node = np.zeros(len(self.nodes))
+        p_node[0] = 1.0
+        slices = self.depth_slices()
+        next(slices)
+        for s in slices:
+            parents = self.parents[s]
+            p_node[s] = p_node[parents] * (1 - self.stop[parents])
+        return (p_node, p_node * self.stop)
+
+    def annotated_tree(self):
+        """Copy of the count tree holding the inclusion probabilities, to be drawn with graphviz.
+        Returns:
+            InclusionNode: the top node of the copy.
+        """
+        p_node, p_leaf = self.inclusion()
+        copies = []
+        for i, node in enumerate(self.nodes):
+            copy = InclusionNode(node.value, node.m)
+            copy.count = tree.new_count(len(node.count), node.count)
+            copy.p_node = float(p_node[i])
+            copy.p_leaf = float(p_leaf[i])
+            copies.append(copy)
+            if i > 0:
+                copies[self.parents[i]].children[node.value] = copy
+        return copies[0]
+
+    def sample_trees(self, n, rng=None):
+        """
+        Returns:
+            [Node]: n trees drawn independently, see sample.
+        """
+        included, _ = self.sample(n, rng)
+        return [self.to_tree(row) for row in included]
+
+
+class MixturePredictor:
+    def __init__(self, posterior, D):
+        """Bayesian model averaged predictions: the next symbol distribution averaged over all the
+        trees of the posterior, sum over T of pi(T|x) * P_T(a|context), instead of the MAP tree alone.
+        Along the context path, the trees stopping at the node of depth d predict with its KT
+        estimator, so P_d(a) = w_d * KT_d(a) + (1 - w_d) * P_d+1(a), w_d being the stop probability
+        beta * Pe / Pw. A context leaving the count tree is predicted uniformly, by the KT estimator
+        of its empty node. A query costs O(D * m).
+
+        Args:
+            posterior (PosteriorTree): the posterior distribution of the trees.
+            D (int): the depth of the tree, also the size of the context.
+        """
+        nodes = posterior.nodes
+        self.m = nodes[0].m
+        self.L = max(0, D - 1)
+        self.stop = posterior.stop
+        # children[i, a]: the index of the child a of node i, -1 when missing
+        self.children = np.full((len(nodes), self.m), -1, dtype=np.int64)
+        for i in range(1, len(nodes)):
+            self.children[posterior.parents[i], nodes[i].value] = i
+        counts = np.array([list(n.count) for n in nodes], dtype=float) + 0.5
+        self.kt = counts / counts.sum(axis=1, keepdims=True)
+
+    def predict(self, windows):
+        """Next symbol distributions of full context windows.
+        Args:
+            windows (np.ndarray): (B, D-1) past symbols, the most recent being the last column.
+        Returns:
+            np.ndarray: (B, m) the distribution of each window.
+        """
+        windows = np.asarray(windows, dtype=np.int64)
+        if windows.ndim == 1:
+            windows = windows.reshape(1, self.L)
+        B = windows.shape[0]
+        node = np.zeros(B, dtype=np.int64)
+        # posterior probability that the tree goes deeper than the current node
+        reach = np.ones(B)
+        probas = np.zeros((B, self.m))
+        for depth in range(self.L + 1):
+            stop = self.stop[node]
+            probas += (reach * stop)[:, None] * self.kt[node]
+            reach = reach * (1 - stop)
+            if depth == self.L:
+                break
+            next_node = self.children[node, windows[:, self.L - 1 - depth]]
+            missing = next_node < 0
+            probas[missing] += reach[missing, None] / self.m
+            reach[missing] = 0.0
+            node = np.where(missing, 0, next_node)
+        # the count tree may be deeper than D, its nodes at the end of the context then predict alone
+        probas += reach[:, None] * self.kt[node]
+        return probas
+
+    def predict_history(self, history):
+        """Next symbol distributions along a whole series.
+        Args:
+            history ([int]): the series.
+        Returns:
+            np.ndarray: (len(history) - D + 1, m) the distribution of history[t] given its D-1 previous
+                symbols, for each t >= D-1.
+        """
+        history = np.asarray(history, dtype=np.int64)
+        if len(history) <= self.L:
+            return np.zeros((0, self.m))
+        if self.L == 0:
+            return self.predict(np.zeros((len(history), 0), dtype=np.int64))
+        return self.predict(sliding_window_view(history[:-1], self.L))
+
+
+def posterior_main(data, m, D, beta):
+    """Build the posterior distribution of the trees of some data.
+    Args:
+        data ([int]): the input data.
+        m (int): the alphabet size.
+        D (int): the depth of the tree, also the size of the context.
+        beta (Fraction): the beta used by some probabilities computations.
+    Returns:
+        PosteriorTree: the posterior distribution.
+    """
+    top = tree.Node(None, m)
+    tree.debug("Building tree")
+    tree.build_counts(top, data, D, lambda value, m: tree.Node(value, m))
+
+    tree.debug("Computing probas")
+    return PosteriorTree(top, beta)
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "./return_class_train.txt"
+    n_samples = int(sys.argv[2]) if len(sys.argv) > 2 and sys.argv[2].isdigit() else 1000
+    data = Data(path)
+
+    posterior = posterior_main(data.data, m=data.m, D=9, beta=Fraction(1, 2))
+    if len(sys.argv) > 2 and sys.argv[2] == "inclusion":
+        print(graphviz.main_node_to_graphviz(posterior.annotated_tree()))
+    else:
+        included, leaves = posterior.sample(n_samples)
+        sizes = leaves.sum(axis=1)
+        tree.debug("Leaves per tree: mean {:.2f}, std {:.2f}, min {}, max {}".format(
+            sizes.mean(), sizes.std(), sizes.min(), sizes.max()))
+        print(graphviz.main_node_to_graphviz(posterior.to_tree(included[0]), only_struct=True))
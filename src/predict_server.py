@@ -0,0 +1,158 @@
+"""Local prediction service for a trained tree saved with model_file.
+
+Protocol: one request per line, made of the context window as space separated symbols
+(the most recent being the last one). The answer is one line made of the m next symbol
+probabilities, or "error <message>". Requests are answered in order on each connection,
+and concurrent requests (from every connection) are predicted together in batches.
+
+Usage: python3 predict_server.py model.ctw [--host HOST --port PORT | --unix PATH]
+"""
+import argparse
+import asyncio
+import numpy as np
+import context_table
+import model_file
+import tree
+
+
+class PredictionService:
+    def __init__(self, flat, tree_index=0, max_batch=4096):
+        """Constructs a prediction service.
+
+        Args:
+            flat (FlatTree): the trained tree, usually loaded with model_file.load.
+            tree_index (int=0): the tree of flat used for predictions.
+            max_batch (int=4096): the maximum number of contexts predicted at once.
+        """
+        self.flat = flat
+        self.table = context_table.ContextTable(flat, tree_index)
+        self.tree_index = tree_index
+        self.max_batch = max_batch
+        self.queue = asyncio.Queue()
+
+    def predict_batch(self, contexts):
+        """Predict the next symbol distribution of many contexts.
+        Args:
+            contexts ([[int]]): the context windows, the most recent symbol being the last one.
+        Returns:
+            np.ndarray: one distribution per context.
+        """
+        L = self.table.L
+        batch = np.zeros((len(contexts), L), dtype=np.int64)
+        lengths = np.empty(len(contexts), dtype=np.int64)
+        for i, context in enumerate(contexts):
+            context = context[len(context) - L:] if len(context) > L else context
+            lengths[i] = len(context)
+            if context:
+                batch[i, L - len(context):] = context
+        probas = np.empty((len(contexts), self.flat.m))
+        full = lengths == L
+        probas[full] = self.table.predict(batch[full])
+        if not full.all():
+            # windows shorter than D-1 symbols are walked in the tree
+            nodes = self.flat.find_batch(batch[~full], lengths[~full], self.tree_index)
+            probas[~full] = self.flat.predictive(nodes)
+        return probas
+
+    async def predict(self, context):
+        """Queue a context and wait for its distribution.
+        Args:
+            context ([int]): the context window, the most recent symbol being the last one.
+        Returns:
+            np.ndarray: the next symbol distribution.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((context, future))
+        return await future
+
+    async def run_batches(self):
+        """Forever predict all the queued contexts, up to max_batch at a time."""
+        while True:
+            items = [await self.queue.get()]
+            while len(items) < self.max_batch and not self.queue.empty():
+                items.append(self.queue.get_nowait())
+            try:
+                probas = self.predict_batch([context for context, _ in items])
+            except Exception as e:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), proba in zip(items, probas):
+                if not future.done():
+                    future.set_result(proba)
+
+    def parse(self, line):
+        """Parse a request line.
+        Returns:
+            [int]: the context window.
+        """
+        context = [int(s) for s in line.split()]
+        if any(not 0 <= s < self.flat.m for s in context):
+            raise ValueError("symbols must be in [0, {})".format(self.flat.m))
+        return context
+
+    async def handle(self, reader, writer):
+        """Serve one connection. Requests are read as soon as they arrive so that pipelined
+        requests of a client are batched together, and answered in order."""
+        pending = asyncio.Queue()
+
+        async def write_answers():
+            while True:
+                future = await pending.get()
+                if future is None:
+                    break
+                try:
+                    proba = await future
+                    answer = " ".join(repr(float(p)) for p in proba)
+                except Exception as e:
+                    answer = "error {}".format(e)
+                writer.write(answer.encode() + b"\n")
+                if pending.empty():
+                    await writer.drain()
+
+        writer_task = asyncio.ensure_future(write_answers())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    context = self.parse(line.decode())
+                    future = asyncio.ensure_future(self.predict(context))
+                except ValueError as e:
+                    future = asyncio.get_running_loop().create_future()
+                    future.set_exception(e)
+                pending.put_nowait(future)
+        finally:
+            pending.put_nowait(None)
+            await writer_task
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8765, unix_path=None):
+        """Serve forever over TCP, or over a Unix socket if unix_path is given."""
+        batcher = asyncio.ensure_future(self.run_batches())
+        if unix_path is not None:
+            server = await asyncio.start_unix_server(self.handle, path=unix_path)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        tree.debug("Serving on {}".format(unix_path if unix_path is not None else "{}:{}".format(host, port)))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve next symbol predictions of a saved tree.")
+    parser.add_argument("model", help="a model file written by model_file")
+    parser.add_argument("--tree", type=int, default=0, help="the tree to use in a k-best model file")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", default=None, help="serve on this Unix socket instead of TCP")
+    parser.add_argument("--max-batch", type=int, default=4096)
+    args = parser.parse_args()
+
+    service = PredictionService(model_file.load(args.model), args.tree, args.max_batch)
+    asyncio.run(service.serve(args.host, args.port, args.unix))
@@ -6,6 +6,13 @@ from fractions import Fraction
 
 
 class ProbNode(tree.Node):
+    __slots__ = ("should_prune", "pm")
+
+    def __init__(self, value, m):
+        super().__init__(value, m)
+        self.should_prune = False
+        self.pm = None
+
     def get_pm(self, beta):
         """
         Returns:
@@ -16,7 +23,7 @@ class ProbNode(tree.Node):
         else:
             left = beta * self.pe
             right = (1 - beta) * \
-                tree.product(c.pm for c in self.children if c is not None)
+                tree.product(c.pm for c in self.iter_children())
             if left >= right:
                 self.should_prune = True
             return max(left, right)
@@ -29,19 +36,35 @@ class ProbNode(tree.Node):
     def prune(self):
         """Prune all nodes marked as so by the Pm computation.
         """
+        self.invalidate_stats()
         if self.should_prune:
-            self.children = [None] * self.m
+            self.children = tree.new_children(self.m)
         else:
-            for c in self.children:
-                if c is not None:
-                    c.prune()
+            for c in self.iter_children():
+                c.prune()
+
+    def pruned_copy(self):
+        """Copy of the tree pruned as prune would, the tree itself being left unpruned.
+        Returns:
+            ProbNode: the top node of the pruned copy, with its own counts so that it is not
+                changed by a later update of this tree.
+        """
+        node = ProbNode(self.value, self.m)
+        node.count = tree.new_count(len(self.count), self.count)
+        node.pe = self.pe
+        node.pw = self.pw
+        node.pm = self.pm
+        if not self.should_prune:
+            for c in self.iter_children():
+                node.children[c.value] = c.pruned_copy()
+        return node
 
     def graphviz_label(self):
         return [
             ("pe", "pe", graphviz.str_fraction),
             ("pw", "pw", graphviz.str_fraction),
             ("pm", "pm", graphviz.str_fraction),
-            ("as", "count", None)
+            ("as", "count", graphviz.str_count)
         ]
 
 
@@ -53,7 +76,7 @@ def prune_tree_main(data, m, D, beta):
         D (int): the depth of the tree, also the size of the context.
         beta (Fraction): the beta used by some probabilities computations.
     Returns:
-        KTreeNode: the top node of the pruned tree.
+        ProbNode: the top node of the pruned tree.
     """
     top = ProbNode(None, m)
     tree.debug("Building tree")
@@ -67,6 +90,67 @@ def prune_tree_main(data, m, D, beta):
     return top
 
 
+def prune_counts_main(counts, beta):
+    """MAPT algorithm on already computed counts.
+    Args:
+        counts (ContextCounts): the counts of the contexts, see context_counts.
+        beta (Fraction): the beta used by some probabilities computations.
+    Returns:
+        ProbNode: the top node of the pruned tree.
+    """
+    tree.debug("Building tree")
+    top = counts.to_tree(lambda value, m: ProbNode(value, m))
+
+    tree.debug("Computing probas")
+    top.compute_probas(beta)
+
+    tree.debug("Pruning tree")
+    top.prune()
+    return top
+
+
+def count_tree_main(data, m, D, beta):
+    """First step of the incremental MAPT algorithm: the unpruned tree with its probabilities,
+    to be updated with new data (see update) and pruned with ProbNode.pruned_copy.
+    Args:
+        data ([int]): the input data.
+        m (int): the alphabet size.
+        D (int): the depth of the tree, also the size of the context.
+        beta (Fraction): the beta used by some probabilities computations.
+    Returns:
+        ProbNode: the top node of the unpruned tree.
+    """
+    top = ProbNode(None, m)
+    tree.debug("Building tree")
+    tree.build_counts(top, data, D, lambda value, m: ProbNode(value, m))
+
+    tree.debug("Computing probas")
+    top.compute_probas(beta)
+    return top
+
+
+def update(top, new_symbols, tail_context, D, beta):
+    """Append new data to an unpruned tree, as returned by count_tree_main: only the counts of the
+    new positions are added, and Pe, Pw and Pm are only recomputed along the paths they touched.
+    Args:
+        top (ProbNode): the top node of the unpruned tree, its probabilities being computed.
+        new_symbols ([int]): the new data.
+        tail_context ([int]): the data already in the tree, at least its last D-1 symbols.
+        D (int): the depth of the tree, also the size of the context.
+        beta (Fraction): the beta used by some probabilities computations.
+    Returns:
+        [ProbNode]: the nodes updated, each one before its parent.
+    """
+    touched = tree.add_counts(top, new_symbols, D, lambda value, m: ProbNode(value, m), tail_context)
+    for node in touched:
+        if node.pe is None:
+            node.pe = node.get_pe()
+        node.pw = node.get_pw(beta)
+        node.should_prune = False
+        node.pm = node.get_pm(beta)
+    return touched
+
+
 if __name__ == "__main__":
     path = "../dataprojet2.txt"
     data = Data(path)
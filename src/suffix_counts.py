@@ -0,0 +1,130 @@
+from bisect import bisect_left
+import numpy as np
+import tree
+
+
+def suffix_array(s):
+    """Suffix array of a sequence of small non negative integers, by prefix doubling.
+    Args:
+        s (np.ndarray): the sequence.
+    Returns:
+        np.ndarray: the start positions of the suffixes of s, in lexicographic order
+            (a suffix being smaller than the longer suffixes it is a prefix of).
+    """
+    n = len(s)
+    rank = np.asarray(s, dtype=np.int64)
+    sa = np.argsort(rank, kind="stable")
+    k = 1
+    while k < n:
+        second = np.full(n, -1, dtype=np.int64)
+        second[:n - k] = rank[k:]
+        sa = np.lexsort((second, rank))
+        first_sorted = rank[sa]
+        second_sorted = second[sa]
+        change = np.empty(n, dtype=bool)
+        change[0] = True
+        change[1:] = (first_sorted[1:] != first_sorted[:-1]) | (second_sorted[1:] != second_sorted[:-1])
+        new_rank = np.empty(n, dtype=np.int64)
+        new_rank[sa] = np.cumsum(change) - 1
+        rank = new_rank
+        if rank.max() == n - 1:
+            break
+        k *= 2
+    return sa
+
+
+class SuffixContextIndex:
+    def __init__(self, data, m):
+        """Index the contexts of a series with the suffix array of the reversed series.
+        The suffix of the reversed series starting at N-1-t reads data[t], data[t-1], data[t-2], ...
+        so the occurrences of the symbol a after the context s are the suffixes starting with a
+        followed by s, which form one interval of the suffix array. Counts of any context, and
+        context trees of any depth, are then answered by binary searches without an N * D blowup.
+
+        Args:
+            data ([int]): the input data.
+            m (int): the alphabet size.
+        """
+        self.m = m
+        self.reversed = np.asarray(data, dtype=np.int64)[::-1].copy()
+        self.n = len(self.reversed)
+        self.sa = suffix_array(self.reversed)
+        self._rev = self.reversed.tolist()
+        self._sa = self.sa.tolist()
+
+    def char(self, i, offset):
+        """
+        Returns:
+            int: the symbol at the given offset of the i-th suffix in order, -1 past its end.
+        """
+        p = self._sa[i] + offset
+        return self._rev[p] if p < self.n else -1
+
+    def refine(self, lo, hi, offset, symbol):
+        """
+        Returns:
+            (int, int): the sub-interval of [lo, hi) of the suffixes having symbol at offset,
+                all the suffixes of [lo, hi) sharing the same offset first symbols.
+        """
+        key = lambda i: self.char(i, offset)
+        start = bisect_left(range(lo, hi), symbol, key=key) + lo
+        end = bisect_left(range(start, hi), symbol + 1, key=key) + start
+        return (start, end)
+
+    def intervals(self, context):
+        """
+        Args:
+            context ([int]): the context, the most recent symbol being the last one.
+        Returns:
+            [(int, int)]: for each next symbol a, the interval of the suffixes starting with a then the context.
+        """
+        res = []
+        for a in range(self.m):
+            lo, hi = self.refine(0, self.n, 0, a)
+            for offset, c in enumerate(reversed(context)):
+                lo, hi = self.refine(lo, hi, offset + 1, c)
+            res.append((lo, hi))
+        return res
+
+    def counts(self, context):
+        """
+        Args:
+            context ([int]): the context, the most recent symbol being the last one.
+        Returns:
+            [int]: the number of occurrences of each symbol after the context, the counts of the
+                corresponding node of tree.build_counts.
+        """
+        return [hi - lo for lo, hi in self.intervals(context)]
+
+    def build_tree(self, node_builder, D=None):
+        """Build the context tree of the series, as tree.build_counts does.
+        Args:
+            node_builder ((int, int) -> Node): the node builder, as in tree.build_counts.
+            D (int|None): the depth of the tree, also the size of the context. When None, the tree
+                has unbounded depth: a context is only expanded while it occurs more than once,
+                the deeper contexts of a single occurrence adding nothing to Pw (CTW* style).
+        Returns:
+            Node: the top node of the tree.
+        """
+        m = self.m
+        top = node_builder(None, m)
+        root_intervals = [self.refine(0, self.n, 0, a) for a in range(m)]
+        top.count = tree.new_count(m, [hi - lo for lo, hi in root_intervals])
+        stack = [(top, 0, root_intervals)]
+        while stack:
+            node, depth, intervals = stack.pop()
+            if D is not None and depth + 1 >= D:
+                continue
+            if D is None and sum(node.count) <= 1:
+                continue
+            for symbol in range(m):
+                child_intervals = [self.refine(lo, hi, depth + 1, symbol) if hi > lo else (lo, lo)
+                                   for lo, hi in intervals]
+                count = [hi - lo for lo, hi in child_intervals]
+                if any(count):
+                    child = node_builder(symbol, m)
+                    child.count = tree.new_count(m, count)
+                    node.children[symbol] = child
+                    stack.append((child, depth + 1, child_intervals))
+        top.invalidate_stats()
+        return top
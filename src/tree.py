@@ -1,10 +1,18 @@
+from array import array
+from bisect import bisect_left
+from collections.abc import Sequence
 from fractions import Fraction
 import graphviz
 import sys
 import math
 
+# alphabet size above which the nodes store their children and counts sparsely
+SPARSE_THRESHOLD = 16
+
 
 class Node:
+    __slots__ = ("m", "value", "children", "count", "pe", "pw", "_stats")
+
     def __init__(self, value, m):
         """Constructs a Node to be used in a tree.
 
@@ -14,38 +22,69 @@ class Node:
         """
         self.m = m
         self.value = value
-        self.children = [None] * m
-        self.count = [0] * m
+        self.children = new_children(m)
+        self.count = new_count(m)
         self.pe = None
         self.pw = None
+        self._stats = None
+
+    def stats(self):
+        """Structural summary of the tree under this node, computed once and cached.
+        The cache is dropped by compute_probas and by pruning.
+        Returns:
+            TreeStats: the summary of this tree.
+        """
+        if self._stats is None:
+            self._stats = compute_stats(self)
+        return self._stats
+
+    def invalidate_stats(self):
+        """Drop the cached structural summary of this node."""
+        self._stats = None
 
     def count_leaves_at_depth(self, D, current_depth=1):
-        return sum(1 for n in build_node_iter(self, at_depth=D) if n.is_leaf())
+        return self.stats().leaves_at_depth(D - current_depth + 1)
 
     def count_leaves(self):
-        return sum(1 for n in build_node_iter(self) if n.is_leaf())
+        return self.stats().leaves
 
     def is_leaf(self):
         """
         Returns:
             bool: True if the node is a leaf ie. if it has no children.
         """
+        if isinstance(self.children, SparseList):
+            return not self.children.indexes
         return all(c is None for c in self.children)
 
+    def iter_children(self):
+        """
+        Yields:
+            Node: the children of this node, in the order of their values, without the missing ones.
+        """
+        if isinstance(self.children, SparseList):
+            for _, c in self.children.sparse_items():
+                yield c
+        else:
+            for c in self.children:
+                if c is not None:
+                    yield c
+
     def get_pe(self):
         """
         Returns:
             Fraction: The Pe probability of this Node, calculated on demand. This value is not stored.
         """
         Ms = sum(self.count)
-        m = self.m
+        # the estimated alphabet, usually m but binary_ctw nodes have m children and 2 counts
+        m = len(self.count)
 
         if Ms == 0:
             return Fraction(1, 1)
 
         num = 1
-        for j in range(m):
-            for i in range(self.count[j]):
+        for c in self.count:
+            for i in range(c):
                 num *= 2 * i + 1
     
         den = 1
@@ -62,19 +101,26 @@ class Node:
         if self.is_leaf():
             return self.pe
         else:
-            sub = (1 - beta) * product(c.pw for c in self.children if c is not None)
+            sub = (1 - beta) * product(c.pw for c in self.iter_children())
             return beta * self.pe + sub
 
+    def log_pe(self):
+        """
+        Returns:
+            float: The natural log of the Pe probability of this Node, from the KT table of its alphabet.
+        """
+        return kt_table(len(self.count)).log_pe(self.count)
+
     def compute_probas(self, beta):
         """Compute all required probability on this Node. And store those values.
         Args:
             beta (Fraction): The beta value used in some probabilities.
         """
-        for c in self.children:
-            if c is not None:
-                c.compute_probas(beta)
+        for c in self.iter_children():
+            c.compute_probas(beta)
         self.pe = self.get_pe()
         self.pw = self.get_pw(beta)
+        self._stats = None
 
     def compute_pi_T(self, beta, D):
         """Compute pi(T) for this top node.
@@ -98,9 +144,40 @@ class Node:
             Fraction: pi(T|x)
         """
         piT = self.compute_pi_T(beta, D)
-        PxT = product(n.pe for n in build_node_iter(self) if n.is_leaf())
+        PxT = self.stats().pe_product
         return (PxT * piT) / prob
 
+    def log_pi_T(self, beta, D):
+        """Compute log pi(T) for this top node, see compute_pi_T.
+        Args:
+            beta (Fraction): the beta used by some probabilities computations.
+            D (int): the depth of the tree, also the size of the context.
+        Returns:
+            float: the natural log of pi(T).
+        """
+        log_alpha = math.log(1 - beta) / (self.m - 1)
+        cardT = self.count_leaves()
+        Ld = self.count_leaves_at_depth(D)
+        return (cardT - 1) * log_alpha + (cardT - Ld) * math.log(beta)
+
+    def log_PxT(self):
+        """Compute log P(x|T) for this top node, ie. the log of the product of the leaves Pe.
+        Returns:
+            float: the natural log of P(x|T).
+        """
+        return self.stats().log_pe
+
+    def log_pi_T_x(self, beta, D, log_prob):
+        """Compute log pi(T|x) for this top node, see compute_pi_T_x.
+        Args:
+            beta (Fraction): the beta used by some probabilities computations.
+            D (int): the depth of the tree, also the size of the context.
+            log_prob (float): the natural log of the normalizer, usually the Pw of the full tree.
+        Returns:
+            float: the natural log of pi(T|x).
+        """
+        return self.log_pi_T(beta, D) + self.log_PxT() - log_prob
+
     def graphviz_label(self):
         """Description of interesting fields of the Node to be used by Graphviz.
         Returns:
@@ -111,23 +188,255 @@ class Node:
         """
         return [
             ("pe", "pe", graphviz.str_fraction),
-            ("as", "count", None)
+            ("as", "count", graphviz.str_count)
         ]
 
+    def graphviz_fill(self):
+        """
+        Returns:
+            string|None: the graphviz fill color of the node, None to leave it unfilled.
+        """
+        return None
+
+class TreeStats:
+    def __init__(self, leaves, leaves_per_depth, pe_product, log_pe):
+        """Structural summary of a tree, see compute_stats.
+
+        Args:
+            leaves (int): the number of leaves.
+            leaves_per_depth ([int]): the number of leaves at each depth, the top node being at depth 1
+                (index 0 is always 0).
+            pe_product (Fraction|None): the product of the leaves Pe, None if the probas are not computed.
+            log_pe (float|None): the natural log of pe_product.
+        """
+        self.leaves = leaves
+        self.leaves_per_depth = leaves_per_depth
+        self.pe_product = pe_product
+        self.log_pe = log_pe
+
+    def leaves_at_depth(self, depth):
+        """
+        Returns:
+            int: the number of leaves at this depth (the top node being at depth 1).
+        """
+        if 0 <= depth < len(self.leaves_per_depth):
+            return self.leaves_per_depth[depth]
+        return 0
+
+
+def compute_stats(top_node):
+    """Compute in a single traversal the structural summary of a tree.
+    Args:
+        top_node (Node): the top node of the tree.
+    Returns:
+        TreeStats: the leaf count, the leaves per depth and the product of the leaves Pe.
+    """
+    leaves = 0
+    leaves_per_depth = [0]
+    pe_product = Fraction(1, 1)
+    log_pe = 0.0
+    stack = [(top_node, 1)]
+    while stack:
+        node, depth = stack.pop()
+        if node.is_leaf():
+            leaves += 1
+            while len(leaves_per_depth) <= depth:
+                leaves_per_depth.append(0)
+            leaves_per_depth[depth] += 1
+            if node.pe is None:
+                pe_product = None
+            elif pe_product is not None:
+                pe_product *= node.pe
+                log_pe += log_fraction(node.pe)
+        else:
+            stack.extend((c, depth + 1) for c in node.iter_children())
+    if pe_product is None:
+        log_pe = None
+    return TreeStats(leaves, leaves_per_depth, pe_product, log_pe)
+
+
+class SparseList(Sequence):
+    __slots__ = ("size", "default", "indexes", "values")
+
+    def __init__(self, size, default, values=None):
+        """A fixed size list storing only the elements different from a default value, in sorted
+        arrays of indexes and values. Used for the children and counts of the nodes over large alphabets.
+
+        Args:
+            size (int): the size of the list.
+            default (object): the value of the elements not stored.
+            values ([object]|None): the initial elements, all default if None.
+        """
+        self.size = size
+        self.default = default
+        self.indexes = []
+        self.values = []
+        if values is not None:
+            for i, v in enumerate(values):
+                if v != default:
+                    self.indexes.append(i)
+                    self.values.append(v)
+
+    def __len__(self):
+        return self.size
+
+    def _check(self, i):
+        if i < 0:
+            i += self.size
+        if not 0 <= i < self.size:
+            raise IndexError("SparseList index out of range")
+        return i
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self.size))]
+        i = self._check(i)
+        pos = bisect_left(self.indexes, i)
+        if pos < len(self.indexes) and self.indexes[pos] == i:
+            return self.values[pos]
+        return self.default
+
+    def __setitem__(self, i, value):
+        i = self._check(i)
+        pos = bisect_left(self.indexes, i)
+        present = pos < len(self.indexes) and self.indexes[pos] == i
+        if value == self.default:
+            if present:
+                del self.indexes[pos]
+                del self.values[pos]
+        elif present:
+            self.values[pos] = value
+        else:
+            self.indexes.insert(pos, i)
+            self.values.insert(pos, value)
+
+    def __iter__(self):
+        pos = 0
+        for i in range(self.size):
+            if pos < len(self.indexes) and self.indexes[pos] == i:
+                yield self.values[pos]
+                pos += 1
+            else:
+                yield self.default
+
+    def sparse_items(self):
+        """
+        Returns:
+            [(int, object)]: the (index, value) of the stored elements, by index.
+        """
+        return list(zip(self.indexes, self.values))
+
+    def __eq__(self, other):
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+def new_children(m):
+    """
+    Returns:
+        [Node|None]: empty children for a node over an alphabet of size m, sparse above SPARSE_THRESHOLD.
+    """
+    if m > SPARSE_THRESHOLD:
+        return SparseList(m, None)
+    return [None] * m
+
+
+def new_count(m, values=None):
+    """
+    Args:
+        m (int): the alphabet size.
+        values ([int]|None): the initial counts, all 0 if None.
+    Returns:
+        [int]: counts for a node over an alphabet of size m, a compact unsigned int array,
+            or sparse above SPARSE_THRESHOLD.
+    """
+    if m > SPARSE_THRESHOLD:
+        return SparseList(m, 0, values)
+    if values is None:
+        return array("I", [0]) * m
+    return array("I", values)
+
+
+class KTTable:
+    def __init__(self, m):
+        """Lookup tables of the KT estimator over an alphabet of size m, grown on demand.
+        The sequential KT probability of a symbol seen c times out of t is (2c + 1) / (2t + m), so
+            log_ratio(c, t) = log(2c + 1) - log(2t + m)
+            log Pe(count) = sum_j sum_{i < count[j]} log(2i + 1) - sum_{i < sum(count)} log(2i + m)
+        are sums of table entries, without any division or log call once the tables are big enough.
+
+        Args:
+            m (int): the alphabet size.
+        """
+        self.m = m
+        self.log_num = []  # log(2i + 1)
+        self.log_den = []  # log(2i + m)
+        self.cum_num = [0.0]  # cum_num[c] = sum_{i < c} log(2i + 1)
+        self.cum_den = [0.0]  # cum_den[t] = sum_{i < t} log(2i + m)
+        self.grow(64)
+
+    def grow(self, n):
+        """Make the tables cover all the counts up to n."""
+        size = len(self.log_num)
+        if n < size:
+            return
+        new_size = max(n + 1, 2 * size)
+        for i in range(size, new_size):
+            self.log_num.append(math.log(2 * i + 1))
+            self.log_den.append(math.log(2 * i + self.m))
+            self.cum_num.append(self.cum_num[-1] + self.log_num[-1])
+            self.cum_den.append(self.cum_den[-1] + self.log_den[-1])
+
+    def log_ratio(self, c, t):
+        """
+        Returns:
+            float: log((2c + 1) / (2t + m)), the log of the KT update of a symbol seen c times out of t.
+        """
+        if t >= len(self.log_den):
+            self.grow(t)
+        return self.log_num[c] - self.log_den[t]
+
+    def log_pe(self, count):
+        """
+        Returns:
+            float: the natural log of the KT estimator probability of some counts, the log of Node.get_pe.
+        """
+        total = sum(count)
+        if total >= len(self.log_den):
+            self.grow(total)
+        res = -self.cum_den[total]
+        for c in count:
+            res += self.cum_num[c]
+        return res
+
+
+_kt_tables = {}
+
+
+def kt_table(m):
+    """
+    Returns:
+        KTTable: the shared KT table of the alphabet size m.
+    """
+    if m not in _kt_tables:
+        _kt_tables[m] = KTTable(m)
+    return _kt_tables[m]
+
+
 def build_node_iter(top_node, at_depth=None, current_depth=1):
     if at_depth is None:
-        for c in top_node.children:
-            if c is not None:
-                for n in build_node_iter(c):
-                    yield n
+        for c in top_node.iter_children():
+            for n in build_node_iter(c):
+                yield n
         yield top_node
     elif current_depth == at_depth:
         yield top_node
     else:
-        for c in top_node.children:
-            if c is not None:
-                for n in build_node_iter(c, at_depth, current_depth + 1):
-                    yield n
+        for c in top_node.iter_children():
+            for n in build_node_iter(c, at_depth, current_depth + 1):
+                yield n
 
 
 def build_counts(top_node, data, D, node_builder):
@@ -152,6 +461,80 @@ def build_counts(top_node, data, D, node_builder):
                     insert_node.children[c] = node_builder(c, m)
                 insert_node = insert_node.children[c]
             insert_node.count[value] += 1
+    top_node.invalidate_stats()
+
+
+def compute_log_probas(top_node, beta):
+    """Log-domain counterpart of Node.compute_probas, for trees whose Fractions would be too large.
+    The nodes are left untouched.
+    Args:
+        top_node (Node): the top node of the tree.
+        beta (Fraction): the beta used by some probabilities computations.
+    Returns:
+        dict: {id(node): (log pe, log pw)} the natural logs of Pe and Pw of every node of the tree.
+    """
+    log_beta = math.log(beta)
+    log_1_beta = math.log(1 - beta)
+    res = {}
+    for node in build_node_iter(top_node):
+        log_pe = node.log_pe()
+        if node.is_leaf():
+            log_pw = log_pe
+        else:
+            sub = log_1_beta + sum(res[id(c)][1] for c in node.iter_children())
+            log_pw = logaddexp(log_beta + log_pe, sub)
+        res[id(node)] = (log_pe, log_pw)
+    return res
+
+
+def logaddexp(a, b):
+    """log(exp(a) + exp(b)) without overflow."""
+    if a < b:
+        a, b = b, a
+    if b == -math.inf:
+        return a
+    return a + math.log1p(math.exp(b - a))
+
+
+def add_counts(top_node, symbols, D, node_builder, context=()):
+    """Count new symbols appended to the data already counted in a tree, as build_counts on the
+    whole series would. The stored Pe of the nodes already computed are updated sequentially,
+    the new nodes have no Pe.
+    Args:
+        top_node (Node): the top node of the tree.
+        symbols ([int]): the new symbols.
+        D (int): the context size.
+        node_builder ((int, int) -> Node): a node builder used when inserting a Node is needed.
+        context ([int]): the data already counted, only its last D-1 symbols are used.
+    Returns:
+        [Node]: the nodes whose counts changed, each one before its parent.
+    """
+    m = top_node.m
+    L = max(0, D - 1)
+    series = list(context[len(context) - min(len(context), L):]) + list(symbols)
+    start = len(series) - len(symbols)
+    touched = {}
+    for t in range(start, len(series)):
+        value = series[t]
+        insert_node = top_node
+        depth = 0
+        path = reversed(series[max(0, t - L):t])
+        while True:
+            count = insert_node.count
+            if insert_node.pe is not None:
+                insert_node.pe *= Fraction(2 * count[value] + 1, 2 * sum(count) + len(count))
+            count[value] += 1
+            touched[id(insert_node)] = (depth, insert_node)
+            c = next(path, None)
+            if c is None:
+                break
+            if insert_node.children[c] is None:
+                insert_node.children[c] = node_builder(c, m)
+            insert_node = insert_node.children[c]
+            depth += 1
+    for _, node in touched.values():
+        node.invalidate_stats()
+    return [node for _, node in sorted(touched.values(), key=lambda item: -item[0])]
 
 
 def product(iter):
@@ -175,4 +558,8 @@ def debug(*args):
     print(*args, file=sys.stderr)
 
 def log10_fraction(f):
-    return math.log10(f.numerator) - math.log10(f.denominator)
\ No newline at end of file
+    return math.log10(f.numerator) - math.log10(f.denominator)
+
+def log_fraction(f):
+    """Natural log of a (possibly huge) positive Fraction, without converting it to a float first."""
+    return math.log(f.numerator) - math.log(f.denominator)
@@ -0,0 +1,129 @@
+from concurrent.futures import ProcessPoolExecutor
+from fractions import Fraction
+import os
+import sys
+from context_counts import ContextCounts
+from data import Data
+import evaluation
+import model_file
+import prob_tree
+import tree
+
+
+class WindowResult:
+    def __init__(self, index, train_start, train_end, test_end, evaluation, model):
+        """Result of one walk-forward window.
+
+        Args:
+            index (int): the index of the window.
+            train_start (int): the first training position.
+            train_end (int): the end (excluded) of the training positions, also the first test position.
+            test_end (int): the end (excluded) of the test positions.
+            evaluation (Evaluation): the scores of the model on the test positions.
+            model (FlatTree): the pruned MAP tree trained on the window.
+        """
+        self.index = index
+        self.train_start = train_start
+        self.train_end = train_end
+        self.test_end = test_end
+        self.evaluation = evaluation
+        self.model = model
+
+
+def schedule(n, train_size, test_size, step=None):
+    """Schedule the walk-forward windows of a series.
+    Args:
+        n (int): the length of the series.
+        train_size (int): the number of training symbols of each window.
+        test_size (int): the number of test symbols following each training window.
+        step (int|None): the shift between two windows, test_size by default.
+    Yields:
+        (int, int, int): the training start, the training end and the test end of each window.
+    """
+    if step is None:
+        step = test_size
+    start = 0
+    while start + train_size < n:
+        yield (start, start + train_size, min(start + train_size + test_size, n))
+        start += step
+
+
+def window_counts(data, m, D, windows):
+    """Counts of each training window. Consecutive windows reuse the previous counts: the symbols
+    whose context starts before the new window are subtracted and the new symbols are added.
+    Args:
+        data ([int]): the series.
+        m (int): the alphabet size.
+        D (int): the depth of the tree, also the size of the context.
+        windows ([(int, int, int)]): the windows, see schedule.
+    Yields:
+        ContextCounts: the counts of each training window, as tree.build_counts(data[start:end]) would.
+    """
+    counts = None
+    previous = None
+    for start, end, _ in windows:
+        if previous is None or not (previous[0] <= start <= previous[1] <= end):
+            counts = ContextCounts.count(data, m, D, t_lo=start, t_hi=end, start_lo=start)
+        else:
+            old_start, old_end = previous
+            removed = ContextCounts.count(data, m, D, t_lo=old_start, t_hi=old_end,
+                                          start_lo=old_start, start_hi=start)
+            added = ContextCounts.count(data, m, D, t_lo=old_end, t_hi=end, start_lo=start)
+            counts = counts.merge(removed, added, signs=[-1, 1])
+        previous = (start, end)
+        yield counts
+
+
+def fit_window(index, counts, beta, window_data, window):
+    """Train the MAP tree of a window and evaluate it on the following test block.
+    window_data is data[start:test_end], so that only the window is sent to the workers."""
+    start, end, test_end = window
+    top = prob_tree.prune_counts_main(counts, beta)
+    model = model_file.FlatTree.from_nodes([top], model_file.KIND_MAP, beta, counts.D)
+    scores = evaluation.evaluate(model, window_data[end - start:], history=window_data[:end - start])
+    return WindowResult(index, start, end, test_end, scores, model)
+
+
+def walk_forward(data, m, D, beta, train_size, test_size, step=None, processes=None, save_dir=None):
+    """Walk-forward backtest: train prob_tree MAP trees on rolling windows and evaluate each one
+    on the block that follows it. The counting is incremental, the fits run in a process pool.
+    Args:
+        data ([int]): the series.
+        m (int): the alphabet size.
+        D (int): the depth of the tree, also the size of the context.
+        beta (Fraction): the beta used by some probabilities computations.
+        train_size (int): the number of training symbols of each window.
+        test_size (int): the number of test symbols following each training window.
+        step (int|None): the shift between two windows, test_size by default.
+        processes (int|None): the number of worker processes, 1 to fit in this process.
+        save_dir (string|None): if given, the model of window i is saved there as window_i.ctw.
+    Returns:
+        [WindowResult]: the result of each window, in order.
+    """
+    windows = list(schedule(len(data), train_size, test_size, step))
+    all_counts = window_counts(data, m, D, windows)
+    if processes == 1:
+        results = [fit_window(i, counts, beta, data[w[0]:w[2]], w)
+                   for i, (counts, w) in enumerate(zip(all_counts, windows))]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = [executor.submit(fit_window, i, counts, beta, data[w[0]:w[2]], w)
+                       for i, (counts, w) in enumerate(zip(all_counts, windows))]
+            results = [f.result() for f in futures]
+
+    if save_dir is not None:
+        os.makedirs(save_dir, exist_ok=True)
+        for r in results:
+            model_file.save(os.path.join(save_dir, "window_{}.ctw".format(r.index)), r.model)
+    return results
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "./return_class_train.txt"
+    data_ = Data(path)
+    results = walk_forward(data_.data, data_.m, D=6, beta=Fraction(1, 2), train_size=5000, test_size=1000)
+    print("window\ttrain_start\ttrain_end\ttest_end\tlog_loss\taccuracy")
+    for r in results:
+        print("{}\t{}\t{}\t{}\t{:.6f}\t{:.4f}".format(r.index, r.train_start, r.train_end, r.test_end,
+                                                     r.evaluation.average_log_loss, r.evaluation.accuracy))
+    tree.debug("{} windows".format(len(results)))